@@ -0,0 +1,247 @@
+##Offline benchmark of the TemplateAnalysis processor.
+##
+##Generates synthetic NanoAOD-like files (see synthetic.py, no network or EOS
+##access needed) and runs TemplateAnalysis over them, the same way
+##coffeaAnalysisTemplate.py does, for every combination of chunk size,
+##executor and number of workers given on the command line.  Every point runs
+##in a fresh process so that the peak memory of one point does not leak into
+##the next.  For each point the throughput, peak RSS and bytes read are
+##printed and saved to a JSON file together with the git commit, so results of
+##different commits can be compared:
+##
+##   python benchmark.py --events 200000 --chunksizes 50000 200000 \
+##                       --executors iterative processes --workers 2 4
+##
+##Results go to benchmark_results/<date>_<commit>.json unless --output is given.
+##
+##With --startup the grid is not run.  Instead it measures what a worker pays
+##before its first chunk: the time to import coffeaAnalysisTemplate in a fresh
+##interpreter, and the time for fresh ("spawn", like on macOS or a dask
+##worker) processes to start and unpickle a TemplateAnalysis.  The heavy
+##modules (HEAVY_MODULES) that got imported on the way are listed too:
+##
+##   python benchmark.py --startup --workers 1 4 --repeat 3
+##
+##The imports of this module are kept light, since the spawned processes
+##import it again.
+import argparse
+import concurrent.futures
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import time
+
+
+BENCH_DIR = "benchmark_data"
+RESULTS_DIR = "benchmark_results"
+## how often a running point is checked for having died without a result
+POLL_SECONDS = 5
+## modules the processing does not need, reported when a worker imports them
+HEAVY_MODULES = ("matplotlib", "pandas", "vector", "mplhep", "dask", "distributed")
+
+
+#--------------------------------------------------
+def peak_rss_mb(who):
+    """Peak resident memory in MB of this process (RUSAGE_SELF) or its finished children."""
+    maxrss = resource.getrusage(who).ru_maxrss
+    ## kB on Linux, bytes on macOS
+    return maxrss / 1024**2 if sys.platform == "darwin" else maxrss / 1024
+
+
+def git_commit():
+    """Short hash of HEAD and whether the tree has local changes (None outside git)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                               capture_output=True, text=True, check=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run_point(ntuples_json, executor_name, workers, chunksize, queue):
+    """Run the analysis once, put the measurements in ``queue``. Runs in its own process."""
+    from coffea import processor
+    from coffea.nanoevents import NanoAODSchema
+
+    from coffeaAnalysisTemplate import DATA, TemplateAnalysis, construct_fileset
+    from executors import executor_context
+    from fileplan import plan_fileset
+
+    fileset = construct_fileset(-1, dataset=DATA, onlyNominal=True, ntuples_json=ntuples_json)
+    fileset, _ = plan_fileset(fileset)
+    with executor_context(executor_name, workers, status=False) as (executor, num_workers):
+        run = processor.Runner(executor=executor, schema=NanoAODSchema,
+                               savemetrics=True, metadata_cache={}, chunksize=chunksize)
+        t0 = time.monotonic()
+        _, metrics = run(fileset, "Events", processor_instance=TemplateAnalysis(DATASET=DATA))
+        walltime = time.monotonic() - t0
+
+    queue.put({
+        "executor": executor_name, "workers": num_workers, "chunksize": chunksize,
+        "walltime_s": walltime, "entries": metrics["entries"], "chunks": metrics["chunks"],
+        "processtime_s": metrics["processtime"], "bytesread": metrics["bytesread"],
+        "throughput_kHz": metrics["entries"] / walltime / 1_000,
+        "throughput_per_worker_kHz": metrics["entries"] / walltime / num_workers / 1_000,
+        "peak_rss_main_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        ## largest of the worker processes, once they have exited
+        "peak_rss_worker_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    })
+
+
+def benchmark_grid(ntuples_json, chunksizes, executors, workers, repeat=1):
+    """Run every point of the grid, return the list of measurements."""
+    ctx = multiprocessing.get_context("spawn")
+    points = []
+    for executor_name, n_workers, chunksize in itertools.product(executors, workers, chunksizes):
+        ## the iterative executor always uses one core
+        point = (executor_name, 1 if executor_name == "iterative" else n_workers, chunksize)
+        if point not in points:
+            points.append(point)
+
+    results = []
+    for (executor_name, n_workers, chunksize), i in itertools.product(points, range(repeat)):
+        result_queue = ctx.Queue()
+        proc = ctx.Process(target=run_point, args=(ntuples_json, executor_name, n_workers, chunksize, result_queue))
+        proc.start()
+        ## a point that crashes (or is killed for lack of memory) never puts a result
+        result = None
+        while result is None:
+            try:
+                result = result_queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                if not proc.is_alive():
+                    break
+        proc.join()
+        if result is None:
+            results.append({"executor": executor_name, "workers": n_workers, "chunksize": chunksize,
+                            "failed": True, "exitcode": proc.exitcode, "repeat": i})
+            print(f"{executor_name:>10} workers={n_workers:<3} chunksize={chunksize:<8} "
+                  f"FAILED (exit code {proc.exitcode})")
+            continue
+        result["repeat"] = i
+        results.append(result)
+        print(f"{executor_name:>10} workers={n_workers:<3} chunksize={chunksize:<8} "
+              f"{result['throughput_kHz']:8.2f} kHz  {result['throughput_per_worker_kHz']:8.2f} kHz/worker  "
+              f"peak RSS {result['peak_rss_main_mb']:7.1f} MB (main) {result['peak_rss_worker_mb']:7.1f} MB (workers)  "
+              f"{result['bytesread'] / 1000**2:8.2f} MB read")
+    return results
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+def heavy_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def import_time(module):
+    """Seconds to import ``module`` in a fresh interpreter, and the HEAVY_MODULES it imported."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = ("import json, sys, time\n"
+            "t0 = time.perf_counter()\n"
+            f"import {module}\n"
+            "seconds = time.perf_counter() - t0\n"
+            f"print(json.dumps([seconds, [name for name in {HEAVY_MODULES!r} if name in sys.modules]]))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def unpickle_processor(payload):
+    """What a worker does with the processor before its first chunk. Runs in the worker."""
+    t0 = time.perf_counter()
+    pickle.loads(payload)
+    return time.perf_counter() - t0, heavy_modules()
+
+
+def worker_spinup(workers):
+    """Start ``workers`` fresh processes and unpickle a TemplateAnalysis in each.
+    Returns the wall time until all are done, the slowest unpickling and the
+    HEAVY_MODULES imported by the workers."""
+    from coffeaAnalysisTemplate import DATA, TemplateAnalysis
+
+    payload = pickle.dumps(TemplateAnalysis(DATASET=DATA))
+    t0 = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(unpickle_processor, [payload] * workers))
+        spinup = time.monotonic() - t0
+    return spinup, max(seconds for seconds, _ in results), sorted({name for _, heavy in results for name in heavy})
+
+
+def benchmark_startup(workers, repeat=1):
+    """Import time of the analysis and worker spin-up for every worker count."""
+    results = []
+    for i in range(repeat):
+        for module in ("coffea.processor", "coffeaAnalysisTemplate"):
+            seconds, heavy = import_time(module)
+            results.append({"measure": "import", "module": module, "seconds": seconds,
+                            "heavy_modules": heavy, "repeat": i})
+            print(f"import {module:<24} {seconds:7.2f} s  heavy modules: {', '.join(heavy) or 'none'}")
+        for n_workers in workers:
+            spinup, unpickle, heavy = worker_spinup(n_workers)
+            results.append({"measure": "spinup", "workers": n_workers, "seconds": spinup,
+                            "unpickle_s": unpickle, "heavy_modules": heavy, "repeat": i})
+            print(f"spin up {n_workers:>3} worker(s)          {spinup:7.2f} s  (unpickling {unpickle:.2f} s)  "
+                  f"heavy modules: {', '.join(heavy) or 'none'}")
+    return results
+#--------------------------------------------------
+
+
+if __name__ == "__main__":
+    from executors import EXECUTORS
+    from synthetic import COMPRESSION, make_synthetic_ntuples
+
+    parser = argparse.ArgumentParser(description="Benchmark TemplateAnalysis on synthetic NanoAOD files")
+    parser.add_argument("--events", type=int, default=100_000, help="events per synthetic file (default: 100000)")
+    parser.add_argument("--files", type=int, default=2, help="synthetic files per process (default: 2)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the synthetic files (default: 0)")
+    parser.add_argument("--compression", choices=COMPRESSION, default="zlib",
+                        help="compression of the synthetic files (default: zlib)")
+    parser.add_argument("--datadir", default=BENCH_DIR, help=f"where to write the synthetic files (default: {BENCH_DIR})")
+    parser.add_argument("--chunksizes", type=int, nargs="+", default=[50_000], help="chunk sizes to run (default: 50000)")
+    parser.add_argument("--executors", choices=EXECUTORS, nargs="+", default=["iterative"],
+                        help="executors to run (default: iterative)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="worker counts to run (default: 1)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per point (default: 1)")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure the import time and the spin-up of --workers fresh workers instead of the grid")
+    parser.add_argument("--output", help=f"results json (default: {RESULTS_DIR}/<date>_<commit>.json)")
+    args = parser.parse_args()
+
+    if args.startup:
+        results = benchmark_startup(args.workers, args.repeat)
+    else:
+        t0 = time.monotonic()
+        ntuples_json = make_synthetic_ntuples(args.datadir, args.events, args.files, args.seed, args.compression)
+        print(f"synthetic files ready in {args.datadir} ({time.monotonic() - t0:.1f} s)")
+        results = benchmark_grid(ntuples_json, args.chunksizes, args.executors, args.workers, args.repeat)
+
+    import coffea
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit, "dirty": dirty,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "coffea": coffea.__version__,
+        "platform": platform.platform(), "cpu_count": os.cpu_count(),
+        "synthetic": None if args.startup else {"events_per_file": args.events, "files_per_process": args.files,
+                                                "seed": args.seed, "compression": args.compression},
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}_{commit or 'nogit'}{'-dirty' if dirty else ''}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
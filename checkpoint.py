@@ -0,0 +1,161 @@
+##Per-chunk checkpoints, so an interrupted run can be resumed.
+##
+##Every chunk the processor finishes is written to its own pickle file in the
+##checkpoint directory, named after (dataset, file, file uuid, entrystart,
+##entrystop).  When the analysis is run again, chunks that already have a
+##checkpoint are not processed; their stored outputs are merged with the output
+##of the chunks that are still missing.  After a crash or Ctrl-C only the
+##unfinished chunks are redone, and adding one file to ntuples.json only costs
+##the chunks of that file, and of the other files of its dataset.
+##
+##The name also includes the normalization of the dataset(s) of the chunk
+##(NORMALIZATION_KEYS of the metadata), which process() bakes into the
+##histograms: when adding a file changes the total "nevts" of a dataset, or
+##--inspect adds its "sumw", the chunks of that dataset are processed again
+##instead of being merged with a stale weight.
+##
+##Checkpoints are kept in a subdirectory named after a hash of the source file
+##that defines the processor, of the modules of this directory it uses (e.g.
+##selection.py, cutflow.py, profiling.py) and of its options (e.g. fused,
+##nminusone), so editing the analysis or turning an option on never mixes
+##outputs of the old and new code.  Changing the chunk size also changes the chunk
+##boundaries, so all chunks are processed again in that case.
+import glob
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import sys
+import uuid
+
+from coffea import processor
+
+
+CHECKPOINT_DIR = "checkpoints"
+## dataset metadata the output of a chunk depends on
+NORMALIZATION_KEYS = ("process", "variation", "xsec", "nevts", "sumw")
+
+
+#--------------------------------------------------
+def normalization(metadata):
+    """NORMALIZATION_KEYS of the dataset metadata of a chunk, or of each of its
+    targets for files shared by several datasets (see fileplan.py)."""
+    metadata = metadata or {}
+    targets = metadata.get("targets") or [metadata]
+    return [[target.get(key) for key in NORMALIZATION_KEYS] for target in targets]
+
+
+def chunk_key(dataset, filename, fileuuid, entrystart, entrystop, metadata=None):
+    """File name (without directory) of the checkpoint of one chunk."""
+    if isinstance(fileuuid, bytes):
+        fileuuid = str(uuid.UUID(bytes=fileuuid)) if fileuuid else ""
+    key = f"{dataset}\n{filename}\n{fileuuid}\n{entrystart}\n{entrystop}\n{normalization(metadata)!r}"
+    return hashlib.sha1(key.encode()).hexdigest() + ".pkl"
+
+
+def local_sources(module, directory=None, found=None):
+    """Source files of ``module`` and of the modules it uses, directly or not,
+    that are in the same directory as ``module``."""
+    path = os.path.abspath(inspect.getsourcefile(module))
+    directory = directory or os.path.dirname(path)
+    found = set() if found is None else found
+    found.add(path)
+    for value in vars(module).values():
+        ## imported modules, and modules of imported classes and functions
+        used = value if inspect.ismodule(value) else sys.modules.get(getattr(value, "__module__", None) or "")
+        source = getattr(used, "__file__", None)
+        if source and source.endswith(".py") and os.path.dirname(os.path.abspath(source)) == directory \
+                and os.path.abspath(source) not in found:
+            local_sources(used, directory, found)
+    return found
+
+
+def processor_tag(processor_instance):
+    """Short hash of the source files of the processor (see local_sources),
+    and of the options (plain attributes) of the instance."""
+    sha1 = hashlib.sha1()
+    for source in sorted(local_sources(sys.modules[type(processor_instance).__module__])):
+        with open(source, "rb") as f:
+            sha1.update(f.read())
+    options = sorted((name, value) for name, value in vars(processor_instance).items()
+                     if isinstance(value, (bool, int, float, str)))
+    sha1.update(repr(options).encode())
+    return sha1.hexdigest()[:12]
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+class CheckpointedProcessor(processor.ProcessorABC):
+    """Wraps a processor and writes the output of every chunk to ``directory``.
+
+    postprocess() does nothing: the Runner only sees the chunks processed in
+    this run, the wrapped processor's postprocess() has to be called on the
+    merged output (see Checkpointer.merge).
+    """
+
+    def __init__(self, processor_instance, directory):
+        self.processor_instance = processor_instance
+        self.directory = directory
+
+    def process(self, events):
+        out = self.processor_instance.process(events)
+        ## chunks read from a local copy (prefetch.py) are saved under the original chunk
+        meta = dict(events.metadata, **events.metadata.get("prefetched", {}))
+        path = os.path.join(self.directory, chunk_key(meta["dataset"], meta["filename"], meta["fileuuid"],
+                                                      meta["entrystart"], meta["entrystop"], meta))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(out, f, protocol=pickle.HIGHEST_PROTOCOL)
+        ## the checkpoint only exists once it is complete
+        os.replace(tmp, path)
+        return out
+
+    def postprocess(self, accumulator):
+        return accumulator
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+class Checkpointer:
+    """Splits the chunks of a run into done and missing ones and merges the outputs."""
+
+    def __init__(self, processor_instance, directory=CHECKPOINT_DIR, reset=False):
+        if reset and os.path.isdir(directory):
+            shutil.rmtree(directory)
+        self.processor_instance = processor_instance
+        ## absolute, workers may run in a different working directory
+        self.directory = os.path.abspath(os.path.join(directory, processor_tag(processor_instance)))
+        os.makedirs(self.directory, exist_ok=True)
+        ## remove leftovers of chunks that were interrupted while being written
+        for tmp in glob.glob(os.path.join(self.directory, "*.tmp")):
+            os.remove(tmp)
+
+    def path(self, item):
+        return os.path.join(self.directory, chunk_key(item.dataset, item.filename, item.fileuuid,
+                                                      item.entrystart, item.entrystop, item.usermeta))
+
+    def split(self, chunks):
+        """Return (missing, done) lists of coffea WorkItems."""
+        missing, done = [], []
+        for item in chunks:
+            (done if os.path.exists(self.path(item)) else missing).append(item)
+        return missing, done
+
+    def wrap(self):
+        """Processor to give to the Runner for the missing chunks."""
+        return CheckpointedProcessor(self.processor_instance, self.directory)
+
+    def load(self, chunks):
+        """Merged output of the checkpoints of ``chunks`` (None if there are none)."""
+        out = None
+        for item in chunks:
+            with open(self.path(item), "rb") as f:
+                out = processor.accumulate([pickle.load(f)], out)
+        return out
+
+    def merge(self, new_output, done):
+        """Add the outputs of the ``done`` chunks to ``new_output`` and postprocess."""
+        out = processor.accumulate([self.load(done), new_output])
+        return self.processor_instance.postprocess(out)
+#--------------------------------------------------
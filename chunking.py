@@ -0,0 +1,159 @@
+##Adaptive chunk sizes.
+##
+##A single CHUNKSIZE does not fit every dataset: the high-multiplicity ttbar
+##and tttt events need much more memory per event (jagged Jet arrays) than
+##wjets or data, and a file of 14 000 events is better processed whole.  With
+##--adaptive-chunks the files are preprocessed whole and cut into chunks
+##during the run by an AdaptiveChunker:
+##
+##   * the first chunk size of every dataset follows from the memory budget
+##     per worker and a guess of the memory per event (KB_PER_EVENT), capped so
+##     that every worker gets some of the dataset's entries, and within
+##     [MIN_CHUNKSIZE, MAX_CHUNKSIZE];
+##   * the chunks are processed in rounds of a few chunks per worker.  Every
+##     chunk reports (ChunkMonitor) its entries, processing time and the peak
+##     memory of its worker.  After each round the size of every dataset is
+##     set to what fits the memory budget, given the memory per event
+##     measured so far, and to what takes about TARGET_CHUNK_SECONDS.  A
+##     size at most doubles from one round to the next.
+##
+##The memory of a chunk is that of the process running it, so every chunk
+##needs a process of its own: the iterative, processes and dask executors
+##work, the threads executor (all chunks in one process) does not and is
+##rejected by coffeaAnalysisTemplate.py.
+##
+##The sizes chosen for every dataset end up in report(), stored in the
+##metrics.  Chunk boundaries depend on the measurements, so a run with
+##adaptive chunks cannot be resumed from checkpoints.
+import math
+import time
+
+from coffea import processor
+from coffea.processor.executor import WorkItem
+
+from profiling import current_rss_mb, high_water_rss_mb, reset_peak_rss
+
+
+MEMORY_BUDGET_MB = 2000
+TARGET_CHUNK_SECONDS = 30
+MIN_CHUNKSIZE = 10_000
+MAX_CHUNKSIZE = 2_000_000
+## memory per event assumed before a dataset has been measured
+KB_PER_EVENT = 10
+## chunk size that makes Runner.preprocess return one WorkItem per file
+WHOLE_FILE = 2**62
+
+
+#--------------------------------------------------
+class ChunkMonitor(processor.ProcessorABC):
+    """Wraps a processor and adds the entries, time and memory of every chunk
+    to its output, as ``output["chunk_stats"]``."""
+
+    def __init__(self, processor_instance):
+        self.processor_instance = processor_instance
+
+    def process(self, events):
+        reset_peak_rss()
+        rss_before = current_rss_mb()
+        t0 = time.perf_counter()
+        out = self.processor_instance.process(events)
+        stats = {"dataset": events.metadata["dataset"], "entries": len(events),
+                 "seconds": time.perf_counter() - t0,
+                 "rss_before_mb": rss_before, "peak_rss_mb": high_water_rss_mb()}
+        return dict(out, chunk_stats=[stats])
+
+    def postprocess(self, accumulator):
+        return accumulator
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+class AdaptiveChunker:
+    """Cuts whole-file WorkItems into chunks whose size follows the measurements."""
+
+    def __init__(self, files, num_workers, memory_mb=MEMORY_BUDGET_MB, target_seconds=TARGET_CHUNK_SECONDS,
+                 min_chunksize=MIN_CHUNKSIZE, max_chunksize=MAX_CHUNKSIZE):
+        self.files = list(files)
+        self.num_workers = max(1, num_workers)
+        self.memory_mb = memory_mb
+        self.target_seconds = target_seconds
+        self.min_chunksize = min_chunksize
+        self.max_chunksize = max_chunksize
+        ## first entry of every file that is not in a chunk yet
+        self.cursor = [item.entrystart for item in self.files]
+
+        entries = {}
+        for item in self.files:
+            entries[item.dataset] = entries.get(item.dataset, 0) + item.entrystop - item.entrystart
+        self.sizes = {}
+        for dataset, n in entries.items():
+            fits = memory_mb * 1024 / KB_PER_EVENT
+            self.sizes[dataset] = self._clamp(min(fits, math.ceil(n / self.num_workers)))
+        ## measured memory per event, and every size used, per dataset
+        self.mb_per_event = {}
+        self.history = {dataset: [size] for dataset, size in self.sizes.items()}
+
+    def _clamp(self, size):
+        return int(min(self.max_chunksize, max(self.min_chunksize, size)))
+
+    def _next_chunk(self, i):
+        item = self.files[i]
+        size = self.sizes[item.dataset]
+        start = self.cursor[i]
+        ## a tail shorter than half a chunk goes with the last chunk
+        stop = item.entrystop if item.entrystop - start < 1.5 * size else start + size
+        self.cursor[i] = stop
+        return WorkItem(item.dataset, item.filename, item.treename, start, stop, item.fileuuid, item.usermeta)
+
+    def rounds(self):
+        """Yield lists of WorkItems, two per worker, until every entry is in a chunk.
+        update() is meant to be called between rounds."""
+        per_round = 2 * self.num_workers
+        while True:
+            chunks = []
+            ## one chunk per file in turn, so every dataset is measured early
+            while len(chunks) < per_round:
+                unfinished = [i for i, item in enumerate(self.files) if self.cursor[i] < item.entrystop]
+                if not unfinished:
+                    break
+                chunks.extend(self._next_chunk(i) for i in unfinished[:per_round - len(chunks)])
+            if not chunks:
+                return
+            yield chunks
+
+    def update(self, chunk_stats):
+        """Adjust the chunk size of every dataset from the ChunkMonitor stats of a round."""
+        by_dataset = {}
+        for stats in chunk_stats:
+            by_dataset.setdefault(stats["dataset"], []).append(stats)
+        for dataset, stats in by_dataset.items():
+            entries = sum(s["entries"] for s in stats)
+            seconds = sum(s["seconds"] for s in stats)
+            growth = sum(max(s["peak_rss_mb"] - s["rss_before_mb"], 0.) for s in stats)
+            baseline = max(s["rss_before_mb"] for s in stats)
+            if entries == 0:
+                continue
+            self.mb_per_event[dataset] = max(growth / entries, 1e-6)
+
+            fits = (self.memory_mb - baseline) / self.mb_per_event[dataset]
+            in_time = entries * self.target_seconds / seconds if seconds > 0 else self.max_chunksize
+            size = self._clamp(min(fits, in_time, 2 * self.sizes[dataset]))
+            if size != self.sizes[dataset]:
+                self.history[dataset].append(size)
+            self.sizes[dataset] = size
+
+    def report(self):
+        """Chunk sizes and measured memory per event of every dataset, for the metrics."""
+        return {"memory_budget_mb": self.memory_mb, "target_chunk_seconds": self.target_seconds,
+                "datasets": {dataset: {"initial_chunksize": history[0], "final_chunksize": history[-1],
+                                       "chunksizes": history,
+                                       "kb_per_event": self.mb_per_event.get(dataset, 0.) * 1024}
+                             for dataset, history in self.history.items()}}
+#--------------------------------------------------
+
+
+def add_metrics(total, metrics):
+    """Add the Runner metrics of one call to ``total``."""
+    for key in ("entries", "processtime", "bytesread", "chunks"):
+        total[key] += metrics[key]
+    return total
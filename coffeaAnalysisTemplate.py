@@ -1,23 +1,28 @@
-import asyncio
-import logging
-import os
-import time
+##TemplateAnalysis, the coffea processor of the analysis, and main(), which
+##runs it over the files of an ntuples json:
+##
+##   python coffeaAnalysisTemplate.py --executor processes --workers 4
+##
+##or, from python,
+##
+##   from coffeaAnalysisTemplate import main
+##   all_histograms, metrics = main(["--executor", "iterative"])
+##
+##Importing this module does not run anything.  Every worker of a process
+##pool or dask cluster imports it to unpickle TemplateAnalysis, so only what
+##process() needs is imported at the top; the modules used to set up the run
+##(Runner, checkpoints, prefetching, ...) are imported inside main().
+##See benchmark.py --startup for the import time and worker spin-up.
+import json
 
-import pickle
-import vector; vector.register_awkward() 
 import awkward as ak
 from coffea import processor
-from coffea.nanoevents import transforms
-from coffea.nanoevents.methods import base, vector
-from coffea.nanoevents import NanoAODSchema
 import hist
-import json
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 import numpy as np
-import uproot
 
-import pandas as pd
+from cutflow import Cutflow
+from profiling import StageProfiler
+from selection import StagedSelection
 
 
 DATA = "SingleMuon"
@@ -38,6 +43,36 @@ CORES_PER_WORKER = 2  # does not do anything, only used for metric gathering (se
 ## scaling for local setups with FuturesExecutor
 NUM_CORES = 4
 
+## execution backend: "iterative" (single core), "threads", "processes" or "dask"
+## (see executors.py); can be overridden with --executor on the command line
+EXECUTOR = "processes"
+
+## groups used for the njets vs nbjets correlation histograms
+SCATTER_GROUPS = {"tttt": "signal",
+                  "ttbar": "background", "wjets": "background", "dyjets": "background",
+                  "data": "data"}
+
+## muon pt threshold of the "exactly one muon" event selection, also used by skim.py
+MUON_PT_MIN = 5
+## jet pt threshold of the selected jets
+JET_PT_MIN = 5
+
+## Systematic variations evaluated by TemplateAnalysis in the same pass over
+## each chunk as the nominal histograms (MC only), and filled into the
+## "variation" axis of every histogram.
+## Weight variations: factor applied to the event weight, either a number or
+## a function of the selected events returning one factor per event
+## (e.g. lambda events: events.LHEScaleWeight[:, 0] for a scale weight).
+## Empty by default: every variation adds a copy of every MC histogram.
+WEIGHT_VARIATIONS = {}
+#WEIGHT_VARIATIONS = {"lumi_up": 1.025, "lumi_down": 0.975}
+## Object scale variations: factor applied to the jet pt before the jet
+## selection, so they change jets_pt, jets_eta and njets.
+JET_PT_SCALES = {}
+#JET_PT_SCALES = {"jes_up": 1.03, "jes_down": 0.97}
+## Variations that need different input files (e.g. other generator tunes)
+## are listed as extra variations in the ntuples json, see construct_fileset.
+
 ##NanoAOD datasets are stored in data/ntuples_nanoaod.json folder. 
 ##This json file contains information about the number of events, 
 ##process and systematic. The following function reads the 
@@ -79,76 +114,59 @@ def construct_fileset(n_files_max_per_sample,
             file_paths = [f["path"] for f in file_list]
             metadata = {"process": "data", "xsec": 1}
             fileset.update({"data": {"files": file_paths, "metadata": metadata}})
+            continue
             
         ##these "variations" are used for systematic studies
         ##A simple example would use only "nominal"
+        ##Weight and jet pt scale variations are evaluated by TemplateAnalysis
+        ##on the nominal files (see WEIGHT_VARIATIONS and JET_PT_SCALES), so a
+        ##variation only becomes a separate dataset if it really has its own files
+        nominal_files = [f["path"] for f in file_info[process].get("nominal", {}).get("files", [])]
         for variation in file_info[process].keys():
             if onlyNominal & ~variation.startswith("nominal"): continue
             #print(variation)
             file_list = file_info[process][variation]["files"]
+            if variation != "nominal" and sorted(f["path"] for f in file_list) == sorted(nominal_files):
+                print(f"{process}__{variation} uses the nominal files, it is not run as a separate dataset")
+                continue
             if n_files_max_per_sample != -1:
                 file_list = file_list[:n_files_max_per_sample] #use partial set
 
             file_paths = [f["path"] for f in file_list]
             nevts_total = sum([f["nevts"] for f in file_list])
             metadata = {"process": process, "variation": variation, "nevts": nevts_total, "xsec": xsec_info[process]}
+            ##sum of the generator weights, in the jsons written by fileinspect.py
+            if all("sumw" in f for f in file_list):
+                metadata["sumw"] = sum(f["sumw"] for f in file_list)
             fileset.update({f"{process}__{variation}": {"files": file_paths, "metadata": metadata}})
 
     return fileset
 #--------------------------------------------------    
 
 
-
-##-------------Build the filesets
-fileset = construct_fileset(N_FILES_MAX_PER_SAMPLE, dataset=DATA,
-                            onlyNominal=True, ntuples_json=NTUPLES) 
-##informational printouts
-print(fileset["ttbar__nominal"]["metadata"])
-print(fileset["tttt__nominal"]["metadata"])
-print(fileset["wjets__nominal"]["metadata"])
-print(fileset["dyjets__nominal"]["metadata"])
-print(fileset["data"]["metadata"])
-print(f"\nExample information in fileset:\n{{\n  'files': [{fileset['data']['files'][:]}]\n")
-##----------------------------------------------------------
-
-
-##---------------------------------------------------------
-## This part is useful to check the total number of
-## data events.  We will need to scale things properly later
-## Load the JSON file
-with open(NTUPLES, 'r') as file:
-    data = json.load(file)
-    #print(type(data))
-
-## Initialize a variable to store the total number of events
-total_events = 0
-
-## Loop through the files in the JSON data
-for file_info in data['data']['SingleMuon']['files']:
-    file_path = file_info['path']
-    #print(file_path)
-
-    ## Open the ROOT file using uproot
-    with uproot.open(file_path) as f:
-        ## Access the 'events' TTree and count the number of entries (events)
-        num_events = f['Events'].num_entries
-
-        ## Print the file path and number of events
-        print("Real data dataset info:")
-        print(f"File: {file_path}, Number of Events: {num_events}")
-
-        ## Add the number of events to the total
-        total_events += num_events
-
-## Print the total number of events
-print(f"Total Number of Events: {total_events}\n")
-#-----------------------------------
-
 ##------------------------------------------------------Analyzer
 ##Here is the main analyzer. Uses coffea/awkward to make the analysis.
 class TemplateAnalysis(processor.ProcessorABC):
-    def __init__(self, DATASET):
+    ## NanoAOD branches that process() reads. skim.py only copies these
+    ## branches into the slim files, so add any new variable used below here too.
+    columns = ["PV_npvsGood",
+               "nMuon", "Muon_pt", "Muon_eta",
+               "nJet", "Jet_pt", "Jet_eta", "Jet_btagCSVV2",
+               ## MC only, used when the normalization uses the sum of generator weights
+               "genWeight"]
+
+    def __init__(self, DATASET, profile=False, fused=False, nminusone=False):
         self.DATASET = DATASET
+        # time every stage of process() and add a StageProfile to the output
+        # (see profiling.py); off by default, it costs a little time per chunk
+        self.profile = profile
+        # also fill the multi-dimensional histograms of several observables
+        # (njets_vs_nbjets, muon_pt_eta, jets_pt_eta) booked below
+        self.fused = fused
+        # also count, for every cut, the events passing all the other cuts
+        # (N-1 yields, see cutflow.py); the later cuts are then evaluated on
+        # the events failing an earlier one too
+        self.nminusone = nminusone
         # booking histograms
         # define categories
         # Take a look at 
@@ -173,45 +191,51 @@ class TemplateAnalysis(processor.ProcessorABC):
             'nbjets'   : (hist.Hist(num_axis, process_cat, variation_cat, storage=hist.storage.Weight()))
         }
         
-        # I think this might have to go
-        # In principle sumw comes from ROOT's sumw(sum weight) function, but I do not know what it does here.
-        sumw_dict = {'sumw': processor.defaultdict_accumulator(float)
-        }
-         
-        
-        ### define vector lists for scatter plot
-        self.njets_signal_data = []
-        self.njets_background_data = []
-        self.nbjets_signal_data = []
-        self.nbjets_background_data = []
-        self.njets_values=[]
-        self.nbjets_values=[]
-        self.njets_data = []
-        self.nbjets_data = []
+
+        ### njets vs nbjets correlation (used for scatter plots)
+        ## Instead of keeping every event in python lists, which grow with the
+        ## number of events and have to be pickled back from every worker, the
+        ## correlation is stored in 2D integer histograms. They have a fixed
+        ## size, and merging chunks is just adding the bin contents.
+        ## One histogram is booked per group of SCATTER_GROUPS, per chunk.
+        self.njets_axis = hist.axis.Integer(0, 20, name="njets", label="Number of jets")
+        self.nbjets_axis = hist.axis.Integer(0, 20, name="nbjets", label="Number of b-jets")
+
+        ### fused histograms, with fused=True
+        ## Several observables of the same events or objects in one histogram,
+        ## weighted and with the process and variation axes like the 1D ones:
+        ## the exact njets vs nbjets correlation of every process, and pt vs eta
+        ## of the muons and jets. hists['muon_pt_eta'].project("eta", "process", "variation")
+        ## is the same as hists['muon_eta'].
+        if self.fused:
+            pt_axis_2d = hist.axis.Regular(bins=100, start=0, stop=500, name="pt", label="$p_{T}$ [GeV]")
+            eta_axis_2d = hist.axis.Regular(bins=40, start=-5, stop=5, name="eta", label="$\\eta$")
+            self.hist_muon_dict.update({
+                'njets_vs_nbjets' : hist.Hist(self.njets_axis, self.nbjets_axis, process_cat, variation_cat, storage=hist.storage.Weight()),
+                'muon_pt_eta'     : hist.Hist(pt_axis_2d, eta_axis_2d, process_cat, variation_cat, storage=hist.storage.Weight()),
+                'jets_pt_eta'     : hist.Hist(pt_axis_2d, eta_axis_2d, process_cat, variation_cat, storage=hist.storage.Weight()),
+            })
+
+    #------Empty njets vs nbjets histogram for one chunk
+    def book_njets_nbjets(self):
+        return hist.Hist(self.njets_axis, self.nbjets_axis, storage=hist.storage.Int64())
 
     #------This process function is the one that
     # is run when the object of this class are forced to "run"
     def process(self, events):
-        hists = self.hist_muon_dict.copy()
-        # this refers to the type of dataset.  Do not confuse the process variable
-        # here, with the name of the function:
-        process = events.metadata["process"]
+        # self.hist_muon_dict is only the (empty) template. Every chunk fills its
+        # own deep copy, otherwise all chunks handled by the same processor
+        # instance (threads, or an iterative run) would fill the same hist.Hist
+        # objects and coffea would add them up more than once when merging.
+        profiler = StageProfiler(self.profile)
+        hists = {name: h.copy() for name, h in self.hist_muon_dict.items()}
+        # A chunk normally belongs to a single dataset. Files shared by several
+        # processes are read only once (see fileplan.py); their chunks carry the
+        # metadata of every dataset that uses them in "targets". The selection
+        # below is done once, and the histograms are filled once per target.
+        targets = events.metadata.get("targets") or [events.metadata]
         #print(events.fields)
 
-        #print(f'Working on process: {process}')
-        #print(f'The dataset is {events.metadata["dataset"]}')
-  
-        if process != "data":
-            # normalization for MC
-            x_sec = events.metadata["xsec"]
-            nevts_total = events.metadata["nevts"]
-            # the luminosity has to be calculated and scaled appropiately
-            # this number is hardcoded here
-            lumi = 2256.38 # /pb integrated luminosity
-            xsec_weight = x_sec * lumi / nevts_total #L*cross-section/N
-        else:
-            xsec_weight = 1
-
 
         #------------------Event Selection
         # Filtering of the data can be done essentially at two levels:
@@ -220,21 +244,30 @@ class TemplateAnalysis(processor.ProcessorABC):
         # could apply event selection requirements.
         # There could be a lot more event selection cuts that need to 
         # be applied, depending on the analysis
+        #
+        # The cuts are applied in stages (see selection.py): every event-level
+        # requirement is applied as soon as it is known, so the collections
+        # needed later (jets, electrons) are only built for the events that
+        # survive.  Cheap cuts on flat event branches go first.
+        # The events after every cut are counted for the cutflow (see cutflow.py),
+        # and so is their sum of genWeights when the file has one: each target
+        # uses the latter if it is normalized with the sum of generator weights.
+        # A cut given as a function of the events can also be applied to the events
+        # that failed an earlier one, which the N-1 yields need.
+        selection = StagedSelection(events, profiler,
+                                    weight=(lambda events: events.genWeight) if "genWeight" in events.fields else None,
+                                    nminusone=self.nminusone)
         
         #Require that the primary vertex in the event is good
-        primary_vertex= events.PV.npvsGood == True
+        #(npvsGood is the number of good primary vertices)
+        selection.require("primary vertex", lambda events: events.PV.npvsGood >= 1)
         
         ## Requirement on number of primary vertex.
         ## Require at least one
-        #primary_vertex=events.PV.npvs >= 1
+        #selection.require("primary vertex", lambda events: events.PV.npvs >= 1)
         
-        ##Trigger selection        
-        #event_filters = ( events.HLT.IsoMu20 == 1 )
-        
-        #update event_filters container
-        #event_filters = event_filters & primary_vertex
-        event_filters=primary_vertex
-        selected_events = events[event_filters]
+        ##Trigger selection, it composes with the cuts above
+        #selection.require("trigger", lambda events: events.HLT.IsoMu20 == 1)
         #--------------------------------------------------------------------------
 
 
@@ -242,34 +275,46 @@ class TemplateAnalysis(processor.ProcessorABC):
         ## This is selection that applies to specific physics objects, like muons, jets, b-jets, etc.
         ## Here are a few examples, mostly commented out for the sake of getting some statistics
         ## from a very low number of events.
+        ## The objects are taken from selection.events, the events that passed the cuts so far
 
         ## Note the use of masks in order to apply certain requirements
-        #muon_is_global= events.Muon.isGlobal == True
-        #muon_is_tracker= events.Muon.isTracker == True
+        #muon_is_global= selection.events.Muon.isGlobal == True
+        #muon_is_tracker= selection.events.Muon.isTracker == True
         
         ## Note that this could be all replaced by Tight, Medium or Loose flags, that should be
         ## operative in 2016 nanoado production
         ## we have reduced the requirements just to get more events
         ## The selection, however, needs to align to what the papers describe for the corresponding analysis
-        #loose_muon_selection = (events.Muon.pt > 10) & (abs(events.Muon.eta)<2.5) \
+        #loose_muon_selection = (selection.events.Muon.pt > 10) & (abs(selection.events.Muon.eta)<2.5) \
         #                        & ((muon_is_global) | (muon_is_tracker)) \
-        #                        & (events.Muon.pfRelIso04_all < 0.25)
-        # selected_muon_selection = (events.Muon.pt > 26) & (abs(events.Muon.eta)<2.1) \
+        #                        & (selection.events.Muon.pfRelIso04_all < 0.25)
+        # selected_muon_selection = (selection.events.Muon.pt > 26) & (abs(selection.events.Muon.eta)<2.1) \
         #                             & ((muon_is_global) & (muon_is_tracker)) \
-        #                             & (events.Muon.nTrackerLayers > 5) & (events.Muon.nStations > 0) \
-        #                             & (abs(events.Muon.dxy) < 0.2) & (abs(events.Muon.dz) < 0.5) \
-        #                             & (events.Muon.pfRelIso04_all < .15)
+        #                             & (selection.events.Muon.nTrackerLayers > 5) & (selection.events.Muon.nStations > 0) \
+        #                             & (abs(selection.events.Muon.dxy) < 0.2) & (abs(selection.events.Muon.dz) < 0.5) \
+        #                             & (selection.events.Muon.pfRelIso04_all < .15)
         ## Note that the selection is done using the masks above
         ## This is how filtering is done in the industry as well
-        #selected_muons = events.Muon[( loose_muon_selection & selected_muon_selection)]
-        #veto_muons = events.Muon[( loose_muon_selection & ~selected_muon_selection)]
-        selected_muons = events.Muon[(events.Muon.pt > 5)]
-        selected_muon = (ak.count(selected_muons.pt, axis=1) == 1 ) 
+        #selected_muons = selection.events.Muon[( loose_muon_selection & selected_muon_selection)]
+        #veto_muons = selection.events.Muon[( loose_muon_selection & ~selected_muon_selection)]
+        ## the muon selection (e.g. the ID requirements above) goes in select_muons,
+        ## it is shared by the collection and the "one muon" cut
+        selected_muons = self.select_muons(selection.events.Muon)
+
+        ## Most events fail the one-muon requirement, so it is applied before
+        ## any jet or electron is looked at. The muons are masked along
+        #selected_muons, veto_muons = selection.require("one muon", ak.count(selected_muons.pt, axis=1) == 1,
+        #                                               selected_muons, veto_muons)
+        selected_muons = selection.require("one muon",
+                                           lambda events: ak.count(self.select_muons(events.Muon).pt, axis=1) == 1,
+                                           selected_muons)
+        ## Exactly zero additional loose muons
+        #veto_muons = selection.require("muon veto", ak.count(veto_muons.pt, axis=1) == 0, veto_muons)
 
         
-        ## Selection of jets
-        #jet_selection = (events.Jet.pt > 30) & (abs(events.Jet.eta) < 2.5) & (events.Jet.jetId > 1)
-        #selected_jets = events.Jet[jet_selection]
+        ## Selection of jets, only for the events with one muon
+        #jet_selection = (selection.events.Jet.pt > 30) & (abs(selection.events.Jet.eta) < 2.5) & (selection.events.Jet.jetId > 1)
+        #selected_jets = selection.events.Jet[jet_selection]
         ## Note here that some functions and tools are already implemented as part of coffea, like the TLorentzVector's nearest()
         ## See: https://github.com/CoffeaTeam/coffea/blob/d3beaff974025aa260efb2df9e8da7138a77b795/src/coffea/nanoevents/methods/vector.py#L779
         ## and the coffea documentation
@@ -279,122 +324,476 @@ class TemplateAnalysis(processor.ProcessorABC):
         #lepton_mask = ak.any(selected_jets.metric_table(selected_lepton, metric=lambda j, e: ak.local_index(j, axis=1) == e.jetIdx,), axis=2)
         #selected_jets = selected_jets[~lepton_mask]
         ##this is an example of how b-jets might be selected
-        #selected_bjets = events.Jet[jet_selection & ~ak.is_none(nearest_lepton) & (events.Jet.btagCSVV2 >=0.8)]
-        #selected_jets_nobjets = events.Jet[jet_selection & ~ak.is_none(nearest_lepton) & ~(events.Jet.btagCSVV2 >=0.8)]
-        selected_jets = events.Jet[(events.Jet.pt > 5)]     
-        selected_bjets = events.Jet[(events.Jet.btagCSVV2 >=0.8)]
+        #selected_bjets = selection.events.Jet[jet_selection & ~ak.is_none(nearest_lepton) & (selection.events.Jet.btagCSVV2 >=0.8)]
+        #selected_jets_nobjets = selection.events.Jet[jet_selection & ~ak.is_none(nearest_lepton) & ~(selection.events.Jet.btagCSVV2 >=0.8)]
+        ## the jet pt cut (JET_PT_MIN) is applied in select_jets, after the
+        ## jet pt scale variations
+        all_jets = selection.events.Jet
+        selected_bjets = selection.events.Jet[(selection.events.Jet.btagCSVV2 >=0.8)]
         
         
-        ## Electron selection
+        ## Electron selection, only for the events with one muon
+        ## (add "nElectron", "Electron_pt", "Electron_eta", "Electron_cutBased" to columns first)
         ##Veto electrons 
-        #veto_electron_selection = (events.Electron.pt > 15) & (abs(events.Electron.eta) < 2.5) & (events.Electron.cutBased == 1)    
+        #veto_electron_selection = (selection.events.Electron.pt > 15) & (abs(selection.events.Electron.eta) < 2.5) & (selection.events.Electron.cutBased == 1)    
         ##tight electrons
-        #selected_electron_selection = (events.Electron.pt > 30) & (abs(events.Electron.eta) < 2.1) & (events.Electron.cutBased == 4)
-        #selected_electrons = events.Electron[ selected_electron_selection & veto_electron_selection]
-        #veto_electrons = events.Electron[ veto_electron_selection ]
-        selected_electrons = events.Electron[(events.Electron.pt > 3)]        
+        #selected_electron_selection = (selection.events.Electron.pt > 30) & (abs(selection.events.Electron.eta) < 2.1) & (selection.events.Electron.cutBased == 4)
+        #selected_electrons = selection.events.Electron[ selected_electron_selection & veto_electron_selection]
+        #veto_electrons = selection.events.Electron[ veto_electron_selection ]
+        profiler.lap("object selection", len(selection.events))
         
-        ## Additional selection
-        ## Exactly zero additional loose muons
-        #veto_muon = (ak.count(veto_muons.pt, axis=1 ) == 0 )
-        #event_filters = event_filters & veto_muon
-        ##Exactly zero veto electrons
-        #veto_electron = (ak.count(veto_electrons.pt, axis=1) == 0 )      
-        #event_filters = event_filters & veto_electron
-        ## At least 6 jets
-        #at_least_one_jet = (ak.count(selected_jets.pt, axis=1) >= 6)
-        #event_filters = event_filters & at_least_one_jet
+        ## Additional selection. Every requirement masks the objects that are used afterwards
+        ## With --nminusone the cuts have to be functions of the events, like the ones above
+        ##Exactly zero veto electrons (veto_electron_selection above, needs the Electron columns)
+        #selected_muons, all_jets, selected_bjets = selection.require(
+        #    "electron veto", lambda events: ak.count(events.Electron.pt[(events.Electron.pt > 15) & (abs(events.Electron.eta) < 2.5)
+        #                                                                & (events.Electron.cutBased == 1)], axis=1) == 0,
+        #    selected_muons, all_jets, selected_bjets)
+        ## At least 6 jets passing the jet selection (see select_jets)
+        #selected_muons, all_jets, selected_bjets = selection.require(
+        #    "6 jets", lambda events: self.select_jets(events.Jet, 1.)[0] >= 6,
+        #    selected_muons, all_jets, selected_bjets)
         ## At least 2 bjets
-        #at_least_two_bjets = (ak.count(selected_bjets.pt, axis=1) >= 2)        
-        #event_filters = event_filters & at_least_two_bjets
-        #print(event_filters)
-        
-        ##overwrite the event filter just to get
-        ##more statistics
-        event_filters = selected_muon
-        selected_events = events[event_filters]
-        selected_muons = selected_muons[event_filters]
-        selected_jets = selected_jets[event_filters]
-        selected_bjets = selected_bjets[event_filters]
-        selected_electrons = selected_electrons[event_filters]
+        #selected_muons, all_jets, selected_bjets = selection.require(
+        #    "2 b-jets", lambda events: ak.count(events.Jet.pt[events.Jet.btagCSVV2 >= 0.8], axis=1) >= 2,
+        #    selected_muons, all_jets, selected_bjets)
+        #print(selection.steps)
+        selected_events = selection.events
                
         
-        ##filling of the histograms with weights       
-        for ivar in [ "pt", "eta" ]:
-            hists[f'muon_{ivar}'].fill(
-                        var=ak.flatten(getattr(selected_muons, ivar)), process=process, variation="nominal", weight=xsec_weight)
-            hists[f'jets_{ivar}'].fill(
-                        var=ak.flatten(getattr(selected_jets, ivar)), process=process, variation="nominal", weight=xsec_weight)
-            hists['nmuons'].fill(var=ak.count(selected_muons.pt, axis=1), process=process, variation="nominal", weight=xsec_weight)
-            hists['njets'].fill(var=ak.count(selected_jets.pt, axis=1), process=process, variation="nominal", weight=xsec_weight)
-            hists['nbjets'].fill(var=ak.count(selected_bjets.pt, axis=1), process=process,variation="nominal", weight=xsec_weight)
-            
-            njets_values = ak.count(selected_jets.pt, axis=1)
-            nbjets_values=ak.count(selected_bjets.pt, axis=1)
-            
-            if process == "tttt":
-                self.njets_signal_data.extend(njets_values)
-                self.nbjets_signal_data.extend(nbjets_values)
-                
-            elif process == "ttbar" or process == "wjets" or process == "dyjets":
-                self.njets_background_data.extend(njets_values)
-                self.nbjets_background_data.extend(nbjets_values)
-                
-            elif process == "data":
-                self.njets_data.extend(njets_values)
-                self.nbjets_data.extend(nbjets_values)
-                
-            output = {"nevents": {events.metadata["dataset"]: len(selected_events)}, "hists" : hists,
-            "njets_signal_data": self.njets_signal_data,
-            "njets_background_data": self.njets_background_data,
-            "nbjets_signal_data": self.nbjets_signal_data,
-            "nbjets_background_data": self.nbjets_background_data, 
-            "njets_data": self.njets_data,
-            "nbjets_data": self.nbjets_data
-            }
-            
+        ##per-event and per-object quantities, computed once and used by every fill below
+        nmuons = ak.to_numpy(ak.count(selected_muons.pt, axis=1))
+        nbjets = ak.to_numpy(ak.count(selected_bjets.pt, axis=1))
+        muon_pt = ak.to_numpy(ak.flatten(selected_muons.pt))
+        muon_eta = ak.to_numpy(ak.flatten(selected_muons.eta))
+        ##the jet quantities depend on the jet pt scale, they are computed once per scale
+        jets = {}
+        profiler.lap("per-event quantities", len(selected_events))
+
+        output = {"nevents": {}, "hists": hists, "njets_nbjets": {}, "cutflow": Cutflow()}
+        for target in targets:
+            # this refers to the type of dataset.  Do not confuse the process variable
+            # here, with the name of the function:
+            process = target["process"]
+            #print(f'Working on process: {process}')
+            #print(f'The dataset is {target["dataset"]}')
+
+            ##systematic variations of this chunk: (name, per-event weights, jet pt scale factor)
+            variations = self.variations(selected_events, target, self.xsec_weight(target))
+            for scale in {v[2] for v in variations}:
+                if scale not in jets:
+                    jets[scale] = self.select_jets(all_jets, scale)
+            njets = jets[1.][0]
+            profiler.lap("variations and jet scales", len(selected_events))
+
+            ##the values, weights and variation labels of all the variations of
+            ##this chunk, concatenated once per kind of object and shared by all
+            ##the histograms of that object
+            muon_fills = self.stack_variations([(name, {"pt": muon_pt, "eta": muon_eta}, w, nmuons)
+                                                for name, w, _ in variations])
+            jet_fills = self.stack_variations([(name, {"pt": jets[scale][1], "eta": jets[scale][2]}, w, jets[scale][0])
+                                               for name, w, scale in variations])
+            event_fills = self.stack_variations([(name, {"nmuons": nmuons, "njets": jets[scale][0], "nbjets": nbjets}, w, None)
+                                                 for name, w, scale in variations])
+            profiler.lap("stack variations", len(selected_events))
+
+            ##filling of the histograms with weights, one fill call per histogram
+            ##for all the variations of this chunk
+            self.fill_stacked(hists['muon_pt'], process, muon_fills, var="pt")
+            profiler.lap("fill muon_pt", len(selected_events))
+            self.fill_stacked(hists['muon_eta'], process, muon_fills, var="eta")
+            profiler.lap("fill muon_eta", len(selected_events))
+            self.fill_stacked(hists['nmuons'], process, event_fills, var="nmuons")
+            profiler.lap("fill nmuons", len(selected_events))
+            self.fill_stacked(hists['jets_pt'], process, jet_fills, var="pt")
+            profiler.lap("fill jets_pt", len(selected_events))
+            self.fill_stacked(hists['jets_eta'], process, jet_fills, var="eta")
+            profiler.lap("fill jets_eta", len(selected_events))
+            self.fill_stacked(hists['njets'], process, event_fills, var="njets")
+            profiler.lap("fill njets", len(selected_events))
+            self.fill_stacked(hists['nbjets'], process, event_fills, var="nbjets")
+            profiler.lap("fill nbjets", len(selected_events))
+            if self.fused:
+                self.fill_stacked(hists['njets_vs_nbjets'], process, event_fills, njets="njets", nbjets="nbjets")
+                self.fill_stacked(hists['muon_pt_eta'], process, muon_fills, pt="pt", eta="eta")
+                self.fill_stacked(hists['jets_pt_eta'], process, jet_fills, pt="pt", eta="eta")
+                profiler.lap("fill fused", len(selected_events))
+
+            ## fill the njets vs nbjets correlation for the group this process belongs to
+            group = SCATTER_GROUPS.get(process)
+            if group is not None:
+                if group not in output["njets_nbjets"]:
+                    output["njets_nbjets"][group] = self.book_njets_nbjets()
+                output["njets_nbjets"][group].fill(njets=njets, nbjets=nbjets)
+            profiler.lap("fill njets_nbjets", len(selected_events))
+
+            output["nevents"][target["dataset"]] = len(selected_events)
+            output["cutflow"].fill(target["dataset"], selection, scale=self.xsec_weight(target),
+                                   weighted="sumw" in target and process != "data")
+
+        if self.profile:
+            output["profile"] = profiler.finish()
         return output
 
+    #------Normalization weight of a dataset
+    @staticmethod
+    def xsec_weight(metadata):
+        if metadata["process"] != "data":
+            # normalization for MC
+            x_sec = metadata["xsec"]
+            # with the sum of generator weights of the files (from fileinspect.py)
+            # every event is also weighted by its genWeight, see variations()
+            nevts_total = metadata.get("sumw", metadata["nevts"])
+            # the luminosity has to be calculated and scaled appropiately
+            # this number is hardcoded here
+            lumi = 2256.38 # /pb integrated luminosity
+            xsec_weight = x_sec * lumi / nevts_total #L*cross-section/N (or sumw)
+        else:
+            xsec_weight = 1
+        return xsec_weight
+
+    #------Systematic variations of one chunk
+    # Returns a list of (variation name, per-event weights, jet pt scale factor).
+    # Data and datasets that are themselves a file-based variation only get
+    # one entry, filled with the variation name of the dataset.
+    def variations(self, selected_events, metadata, xsec_weight):
+        nominal = np.full(len(selected_events), xsec_weight, dtype=np.float64)
+        if "sumw" in metadata and metadata["process"] != "data":
+            nominal = nominal * ak.to_numpy(selected_events.genWeight)
+        file_variation = metadata.get("variation", "nominal")
+        if metadata["process"] == "data" or file_variation != "nominal":
+            return [(file_variation, nominal, 1.)]
+
+        variations = [("nominal", nominal, 1.)]
+        for name, factor in WEIGHT_VARIATIONS.items():
+            if callable(factor):
+                factor = ak.to_numpy(factor(selected_events))
+            variations.append((name, nominal * factor, 1.))
+        for name, scale in JET_PT_SCALES.items():
+            variations.append((name, nominal, scale))
+        return variations
+
+    #------Muons passing the selection
+    @staticmethod
+    def select_muons(muons):
+        return muons[muons.pt > MUON_PT_MIN]
+
+    #------Jets passing the selection after scaling their pt by scale
+    # Returns (number of jets per event, flat jet pt, flat jet eta)
+    @staticmethod
+    def select_jets(jets, scale):
+        jet_pt = jets.pt * scale if scale != 1. else jets.pt
+        jet_mask = jet_pt > JET_PT_MIN
+        return (ak.to_numpy(ak.sum(jet_mask, axis=1)),
+                ak.to_numpy(ak.flatten(jet_pt[jet_mask])),
+                ak.to_numpy(ak.flatten(jets.eta[jet_mask])))
+
+    #------Concatenate the values of all variations, for fill_stacked
+    # fills is a list of (variation, {column: values}, per-event weights, counts):
+    # for per-object values counts is the number of objects per event, used to
+    # repeat the event weights; for per-event values it is None.
+    # Returns (columns, weights, variation labels), one entry per value.
+    @staticmethod
+    def stack_variations(fills):
+        columns = {column: np.concatenate([values[column] for _, values, _, _ in fills]) for column in fills[0][1]}
+        weights = [w if counts is None else np.repeat(w, counts) for _, _, w, counts in fills]
+        labels = np.repeat([name for name, _, _, _ in fills], [len(w) for w in weights])
+        return columns, np.concatenate(weights), labels
+
+    #------Fill all variations of a histogram with a single fill call
+    # axes maps the axes of h to columns of stacked (see stack_variations),
+    # e.g. var="pt", or pt="pt", eta="eta" for a 2D histogram
+    @staticmethod
+    def fill_stacked(h, process, stacked, **axes):
+        columns, weights, labels = stacked
+        h.fill(process=process, variation=labels, weight=weights,
+               **{axis: columns[column] for axis, column in axes.items()})
+
     def postprocess(self, accumulator):        
         return accumulator
 #--------------------------------------------    
 
+
 #--------------------------------------------
-# Run the executor
-# The iterative executor is a local, simple executor
-# The FuturesExecutor manages threads in a more efficient way
-#executor = processor.FuturesExecutor()
-executor = processor.IterativeExecutor()
-
-run = processor.Runner(executor=executor, schema=NanoAODSchema, 
-                       savemetrics=True, metadata_cache={}, chunksize=CHUNKSIZE)
-t0 = time.monotonic()
-all_histograms, metrics = run(fileset, "Events", processor_instance=TemplateAnalysis(DATASET=DATA))
-exec_time = time.monotonic() - t0
+def main(argv=None):
+    """Run TemplateAnalysis with the command line options ``argv`` (sys.argv
+    if None) and write the histograms. Returns ``(all_histograms, metrics)``."""
+    import argparse
+    import pickle
+    import time
+
+    from coffea.nanoevents import NanoAODSchema
+
+    from checkpoint import CHECKPOINT_DIR, Checkpointer
+    from cutflow import CUTFLOW
+    from chunking import MEMORY_BUDGET_MB, WHOLE_FILE, AdaptiveChunker, ChunkMonitor, add_metrics
+    from executors import EXECUTORS, executor_context
+    from filecache import METADATA_CACHE, FileMetadataCache
+    from fileinspect import INSPECT_WORKERS, count_entries, inspect_ntuples
+    from fileplan import plan_fileset
+    from histfile import HIST_DIR, save_histograms
+    from prefetch import PREFETCH_DIR, Prefetcher
+
+    ##-------------Command line options
+    ## The defaults are the settings at the top of this file
+    parser = argparse.ArgumentParser(description="Run the TemplateAnalysis coffea processor")
+    parser.add_argument("--executor", choices=EXECUTORS, default=EXECUTOR,
+                        help=f"execution backend for the Runner (default: {EXECUTOR})")
+    parser.add_argument("--workers", type=int, default=NUM_CORES,
+                        help=f"number of threads/processes/dask workers (default: {NUM_CORES})")
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE,
+                        help=f"number of events per chunk (default: {CHUNKSIZE})")
+    parser.add_argument("--ntuples", default=NTUPLES,
+                        help=f"json file with the input files (default: {NTUPLES})")
+    parser.add_argument("--nfiles", type=int, default=N_FILES_MAX_PER_SAMPLE,
+                        help=f"input files per process, -1 means all (default: {N_FILES_MAX_PER_SAMPLE})")
+    parser.add_argument("--inspect", action="store_true",
+                        help="count the events and generator weights of every file first, and normalize "
+                             "the MC with the sum of generator weights (see fileinspect.py)")
+    parser.add_argument("--inspect-workers", type=int, default=INSPECT_WORKERS,
+                        help=f"files opened at the same time to count events (default: {INSPECT_WORKERS})")
+    parser.add_argument("--metadata-cache", default=METADATA_CACHE,
+                        help=f"json file caching the number of entries of every input file (default: {METADATA_CACHE})")
+    parser.add_argument("--refresh-metadata", action="store_true",
+                        help="ignore the metadata cache and reopen every input file")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR,
+                        help=f"directory for the per-chunk checkpoints (default: {CHECKPOINT_DIR})")
+    parser.add_argument("--reset-checkpoints", action="store_true",
+                        help="delete all checkpoints and process every chunk again")
+    parser.add_argument("--no-file-dedup", action="store_true",
+                        help="read files shared by several processes once per process")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every stage of TemplateAnalysis.process and print the result")
+    parser.add_argument("--fused", action="store_true",
+                        help="also fill the njets vs nbjets and pt vs eta histograms of every process and variation")
+    parser.add_argument("--nminusone", action="store_true",
+                        help="also count the N-1 yield of every cut, the events passing all the other cuts")
+    parser.add_argument("--cutflow", default=CUTFLOW,
+                        help=f"json file for the cutflow and N-1 yields (default: {CUTFLOW})")
+    parser.add_argument("--adaptive-chunks", action="store_true",
+                        help="choose the chunk size of every dataset during the run from the memory and time "
+                             "its chunks take, instead of --chunksize (no checkpoint resume). Not with "
+                             "--executor threads: the threads share one process, so the memory of a chunk "
+                             "cannot be told apart from that of the others")
+    parser.add_argument("--memory-budget-mb", type=float, default=MEMORY_BUDGET_MB,
+                        help=f"memory per worker the adaptive chunks aim for (default: {MEMORY_BUDGET_MB})")
+    parser.add_argument("--prefetch", type=int, default=0, metavar="DEPTH",
+                        help="copy the needed branches of up to DEPTH upcoming chunks of remote files "
+                             "to local disk while processing, 0 turns it off (default: 0)")
+    parser.add_argument("--prefetch-cache-mb", type=float, default=0,
+                        help=f"keep the prefetched chunks in {PREFETCH_DIR}/ up to this size for later runs (default: 0)")
+    parser.add_argument("--prefetch-latency", type=float, default=0,
+                        help="prefetch local files too, adding this latency in seconds to every read, "
+                             "to mimic a remote server (default: 0)")
+    parser.add_argument("--output", default=HIST_DIR,
+                        help=f"directory for the histograms, see histfile.py (default: {HIST_DIR})")
+    parser.add_argument("--pickle", action="store_true",
+                        help="also write all histograms to histograms.pkl, like older versions")
+    args = parser.parse_args(argv)
+    if args.adaptive_chunks and args.executor == "threads":
+        parser.error("--adaptive-chunks measures the memory of every chunk from the memory of its process, "
+                     "which the threads executor shares between all workers; use --executor processes")
+
+    ## entries, uuid and cluster boundaries of every input file seen before
+    ## (see filecache.py), shared by the data event count and the Runner
+    metadata_cache = FileMetadataCache(args.metadata_cache, refresh=args.refresh_metadata)
+    ##----------------------------------------------------------
+
+
+    ##-------------Check the files and count their events, see fileinspect.py
+    ##The rest of the run uses the inspected copy of the json
+    if args.inspect:
+        t_inspect = time.monotonic()
+        args.ntuples, warnings = inspect_ntuples(args.ntuples, metadata_cache=metadata_cache,
+                                                 workers=args.inspect_workers)
+        for warning in warnings:
+            print(f"warning: {warning}")
+        print(f"files inspected in {time.monotonic() - t_inspect:.1f} s, using {args.ntuples}")
+    ##----------------------------------------------------------
+
+
+    ##-------------Build the filesets
+    fileset = construct_fileset(args.nfiles, dataset=DATA,
+                                onlyNominal=True, ntuples_json=args.ntuples) 
+    ##informational printouts
+    print(fileset["ttbar__nominal"]["metadata"])
+    print(fileset["tttt__nominal"]["metadata"])
+    print(fileset["wjets__nominal"]["metadata"])
+    print(fileset["dyjets__nominal"]["metadata"])
+    print(fileset["data"]["metadata"])
+    print(f"\nExample information in fileset:\n{{\n  'files': [{fileset['data']['files'][:]}]\n")
+    ##----------------------------------------------------------
+
+
+    ##---------------------------------------------------------
+    ## This part is useful to check the total number of
+    ## data events.  We will need to scale things properly later
+    ## Load the JSON file
+    with open(args.ntuples, 'r') as file:
+        data = json.load(file)
+        #print(type(data))
+
+    ## Initialize a variable to store the total number of events
+    total_events = 0
+
+    ## Count the number of entries (events) in the 'Events' TTree of every file.
+    ## The files that are not in the metadata cache yet are opened in parallel
+    data_files = [file_info['path'] for file_info in data['data']['SingleMuon']['files']]
+    entries = count_entries(data_files, metadata_cache, workers=args.inspect_workers)
+
+    ## Loop through the files in the JSON data
+    for file_path in data_files:
+        #print(file_path)
+        num_events = entries[file_path]
+
+        ## Print the file path and number of events
+        print("Real data dataset info:")
+        print(f"File: {file_path}, Number of Events: {num_events}")
+
+        ## Add the number of events to the total
+        total_events += num_events
+
+    ## Print the total number of events
+    print(f"Total Number of Events: {total_events}\n")
+    #-----------------------------------
+
+
+    ##---------------------------------------------------------
+    ## Files used by several processes (e.g. ttbar and tttt) are read only
+    ## once, the histograms of every process are filled from the same chunk.
+    ## See fileplan.py
+    if args.no_file_dedup:
+        run_fileset, io_saved = fileset, {}
+    else:
+        run_fileset, io_saved = plan_fileset(fileset, metadata_cache)
+        print(f"{io_saved['shared_files']} file(s) shared between processes are read once: "
+              f"{io_saved['reads_saved']} file reads, {io_saved['entries_saved']} entries "
+              f"and {io_saved['bytes_saved']/1000**2:.2f} MB saved\n")
+    metadata_cache.save()
+    #-----------------------------------
+
+
+    #--------------------------------------------
+    # Run the executor
+    # The iterative executor is a local, simple executor, it uses a single core.
+    # The "threads" and "processes" backends use a FuturesExecutor with
+    # args.workers threads or processes, "dask" starts a local dask cluster.
+    # See executors.py
+    # Every finished chunk is saved in args.checkpoint_dir. Chunks that were
+    # already processed by an earlier (possibly interrupted) run are not run
+    # again, their saved output is merged in at the end. See checkpoint.py
+    # With --adaptive-chunks the chunk size of every dataset is decided during
+    # the run instead, from the memory and time used by its chunks. See chunking.py
+    analysis = TemplateAnalysis(DATASET=DATA, profile=args.profile, fused=args.fused,
+                                nminusone=args.nminusone)
+    checkpointer = Checkpointer(analysis, args.checkpoint_dir, reset=args.reset_checkpoints)
+    with executor_context(args.executor, args.workers) as (executor, num_workers):
+        run = processor.Runner(executor=executor, schema=NanoAODSchema, 
+                               savemetrics=True, metadata_cache=metadata_cache,
+                               chunksize=WHOLE_FILE if args.adaptive_chunks else args.chunksize)
+        t0 = time.monotonic()
+        chunks = list(run.preprocess(run_fileset, "Events"))
+        if args.adaptive_chunks:
+            ## the chunk boundaries are not known in advance, nothing is restored from checkpoints
+            chunker = AdaptiveChunker(chunks, num_workers, memory_mb=args.memory_budget_mb)
+            rounds, done_chunks = chunker.rounds(), []
+            processor_instance = ChunkMonitor(analysis)
+        else:
+            chunker = None
+            missing_chunks, done_chunks = checkpointer.split(chunks)
+            print(f"{len(done_chunks)} of {len(chunks)} chunks restored from checkpoints in {checkpointer.directory}")
+            rounds = [missing_chunks] if missing_chunks else []
+            processor_instance = checkpointer.wrap()
+        ## with prefetching the chunks are given to the Runner in batches of num_workers,
+        ## while the next ones are fetched in the background (see prefetch.py)
+        prefetcher = None
+        if args.prefetch > 0:
+            prefetcher = Prefetcher(analysis.columns, PREFETCH_DIR, depth=args.prefetch,
+                                    cache_mb=args.prefetch_cache_mb, latency=args.prefetch_latency)
+
+        new_output, metrics = None, {"entries": 0, "processtime": 0., "bytesread": 0, "chunks": 0}
+        for round_chunks in rounds:
+            for batch in (prefetcher.batches(round_chunks, num_workers) if prefetcher else [round_chunks]):
+                batch_output, batch_metrics = run(batch, "Events", processor_instance=processor_instance)
+                if prefetcher:
+                    prefetcher.release(batch)
+                if chunker:
+                    chunker.update(batch_output.pop("chunk_stats"))
+                new_output = processor.accumulate([batch_output], new_output)
+                add_metrics(metrics, batch_metrics)
+        if prefetcher:
+            metrics["prefetch"] = prefetcher.report()
+        if chunker:
+            metrics["chunking"] = chunker.report()
+        all_histograms = checkpointer.merge(new_output, done_chunks)
+        exec_time = time.monotonic() - t0
+    ## files newly preprocessed by the Runner are remembered for the next run
+    metadata_cache.save()
+    #--------------------------------------------
+        
+
+    #-------------------------- --------------------------------------------
+    # Now, we extract the data that we will later use
+    nevents_info = all_histograms["nevents"]
+    for dataset, num_events in nevents_info.items():
+        print(f"Dataset: {dataset}, Number of Events: {num_events}")
+    ## njets vs nbjets 2D histograms, e.g. for scatter plots:
+    ## njets_nbjets["signal"].values() is the (njets, nbjets) matrix of event counts,
+    ## njets_nbjets["signal"].project("njets") the njets distribution
+    njets_nbjets = all_histograms["njets_nbjets"]
+    for group, h2d in njets_nbjets.items():
+        print(f"njets vs nbjets ({group}): {h2d.sum()} events")
+
+    ## events after every cut, and N-1 yields with --nminusone (see cutflow.py)
+    cutflow = all_histograms["cutflow"]
+    print(f"\nCutflow:\n{cutflow}\n")
+    cutflow.save(args.cutflow)
+    metrics["cutflow"] = cutflow.summary()
+
+    #save histograms, one file per histogram/process/variation (see histfile.py)
+    save_histograms(all_histograms["hists"], args.output)
+    print(f"histograms written to {args.output}/")
+    #and, if asked for, in a single pkl file
+    if args.pickle:
+        with open("histograms.pkl", "wb") as f: 
+            pickle.dump(all_histograms["hists"], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    #this is just bookeeping
+    # num_workers is the number of chunks that really ran at the same time
+    # (1 for the iterative executor), so the rates below are true per-worker rates
+    dataset_source = "/data" if fileset["ttbar__nominal"]["files"][0].startswith("/data") else "other"
+    metrics.update({"walltime": exec_time, "executor": args.executor, "num_workers": num_workers,
+                    "dataset_source": dataset_source, 
+                    "n_files_max_per_sample": args.nfiles, 
+                    "cores_per_worker": CORES_PER_WORKER, "chunksize": "adaptive" if args.adaptive_chunks else args.chunksize,
+                    "chunks_from_checkpoints": len(done_chunks), "io_saved_by_file_dedup": io_saved})
+    ## only the chunks processed in this run count for the rates
+    metrics["event_rate_per_worker_kHz"] = metrics["entries"] / num_workers / exec_time / 1_000
+    metrics["processtime_rate_per_worker_kHz"] = (metrics["entries"] / metrics["processtime"] / 1_000
+                                                  if metrics["processtime"] else 0.)
+    print(f"executor: {args.executor} with {num_workers} worker(s)")
+    print(f"event rate per worker (full execution time divided by num_workers={num_workers}): {metrics['event_rate_per_worker_kHz']:.2f} kHz")
+    print(f"event rate per worker (pure processtime): {metrics['processtime_rate_per_worker_kHz']:.2f} kHz")
+    print(f"amount of data read: {metrics['bytesread']/1000**2:.2f} MB")  # likely buggy: https://github.com/CoffeaTeam/coffea/issues/717
+    if "prefetch" in metrics:
+        report = metrics["prefetch"]
+        print(f"prefetch: {report['chunks']} chunks ({report['cache_hits']} from the disk cache), "
+              f"{report['bytes']/1000**2:.2f} MB fetched in {report['fetch_time_s']:.1f} s, "
+              f"processing waited {report['stall_s']:.1f} s, {report['hidden_s']:.1f} s of I/O hidden")
+    if "chunking" in metrics:
+        for dataset, info in metrics["chunking"]["datasets"].items():
+            print(f"chunk size of {dataset}: {' -> '.join(map(str, info['chunksizes']))} "
+                  f"({info['kb_per_event']:.1f} kB/event measured)")
+
+    ## per-stage timing of process(), with --profile (see profiling.py).
+    ## Chunks restored from checkpoints only contribute if they were also profiled
+    if "profile" in all_histograms:
+        metrics["stages"] = all_histograms["profile"].summary()
+        print(f"\nTemplateAnalysis.process stages:\n{all_histograms['profile']}")
+
+    return all_histograms, metrics
 #--------------------------------------------
-    
 
-#-------------------------- --------------------------------------------
-# Now, we extract the data that we will later use
-nevents_info = all_histograms["nevents"]
-for dataset, num_events in nevents_info.items():
-    print(f"Dataset: {dataset}, Number of Events: {num_events}")
-njsig = all_histograms["njets_signal_data"]
-njbkg = all_histograms["njets_background_data"]
-nbjsig = all_histograms["nbjets_signal_data"]
-nbjbkg = all_histograms["nbjets_background_data"]
-njdata = all_histograms["njets_data"]
-nbjdata = all_histograms["nbjets_data"]
-
-#save histograms in pkl file
-with open("histograms.pkl", "wb") as f: 
-    pickle.dump(all_histograms["hists"], f, protocol=pickle.HIGHEST_PROTOCOL)
-
-#this is just bookeeping
-dataset_source = "/data" if fileset["ttbar__nominal"]["files"][0].startswith("/data") else "other"
-metrics.update({"walltime": exec_time, "num_workers": NUM_CORES, "dataset_source": dataset_source, 
-                "n_files_max_per_sample": N_FILES_MAX_PER_SAMPLE, 
-                "cores_per_worker": CORES_PER_WORKER, "chunksize": CHUNKSIZE})
-print(f"event rate per worker (full execution time divided by NUM_CORES={NUM_CORES}): {metrics['entries'] / NUM_CORES / exec_time / 1_000:.2f} kHz")
-print(f"event rate per worker (pure processtime): {metrics['entries'] / metrics['processtime'] / 1_000:.2f} kHz")
-print(f"amount of data read: {metrics['bytesread']/1000**2:.2f} MB")  # likely buggy: https://github.com/CoffeaTeam/coffea/issues/717
+
+if __name__ == "__main__":
+    main()
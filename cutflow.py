@@ -0,0 +1,87 @@
+##Cutflow and N-1 yields of the event selection.
+##
+##TemplateAnalysis.process fills a Cutflow from its StagedSelection (see
+##selection.py) for every dataset of a chunk, with the counts the selection
+##made anyway while applying the cuts:
+##
+##   * the events after every cut, unweighted and weighted with the
+##     normalization of the dataset (xsec * lumi / nevts, times the genWeight
+##     for the datasets normalized with the sum of generator weights: the
+##     selection counts both, and each dataset of a shared file picks its own),
+##   * with --nminusone, the N-1 yield of every cut: the events passing all
+##     the other cuts.
+##
+##A Cutflow is a coffea accumulator, merged across chunks and workers like
+##the histograms, and of fixed size: one entry per dataset and cut.  The
+##result is printed at the end of the run and written to cutflow.json.
+import json
+
+from coffea import processor
+
+
+CUTFLOW = "cutflow.json"
+
+
+#--------------------------------------------------
+class Cutflow(processor.AccumulatorABC):
+    """Events and weighted events after every cut, and N-1 yields, per dataset."""
+
+    def __init__(self):
+        ## dataset -> {"steps": {cut: [events, weighted]}, "nminusone": {cut: [events, weighted]}},
+        ## the cuts in the order they are applied
+        self.datasets = {}
+
+    def identity(self):
+        return Cutflow()
+
+    def add(self, other):
+        for dataset, tables in other.datasets.items():
+            mine = self.datasets.setdefault(dataset, {"steps": {}, "nminusone": {}})
+            for table, rows in tables.items():
+                for cut, (events, weighted) in rows.items():
+                    row = mine[table].setdefault(cut, [0, 0.])
+                    row[0] += events
+                    row[1] += weighted
+
+    def fill(self, dataset, selection, scale=1., weighted=False):
+        """Add the yields of a StagedSelection.  The weighted events are ``scale``
+        times the sums of weights of the selection if ``weighted``, times the
+        number of events otherwise."""
+        mine = self.datasets.setdefault(dataset, {"steps": {}, "nminusone": {}})
+        rows = [("steps", name, events, sumw) for name, events, sumw in selection.yields]
+        rows += [("nminusone", name, events, sumw) for name, (events, sumw) in selection.nminusone_yields().items()]
+        for table, name, events, sumw in rows:
+            row = mine[table].setdefault(name, [0, 0.])
+            row[0] += events
+            row[1] += (sumw if weighted else events) * scale
+
+    def summary(self):
+        """Plain dictionary, e.g. to write to json: per dataset and cut, the events
+        and weighted events after it, its efficiency and its N-1 yields."""
+        summary = {}
+        for dataset, tables in self.datasets.items():
+            cuts, previous = {}, None
+            for cut, (events, weighted) in tables["steps"].items():
+                cuts[cut] = {"events": events, "weighted": weighted,
+                             "efficiency": events / previous if previous else 1.}
+                if cut in tables["nminusone"]:
+                    cuts[cut]["nminusone_events"], cuts[cut]["nminusone_weighted"] = tables["nminusone"][cut]
+                previous = events
+            summary[dataset] = cuts
+        return summary
+
+    def save(self, path=CUTFLOW):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def __str__(self):
+        lines = []
+        for dataset, cuts in self.summary().items():
+            lines.append(f"{dataset}")
+            lines.append(f"  {'cut':<24}{'events':>12}{'weighted':>14}{'efficiency':>12}{'N-1 events':>12}{'N-1 weighted':>14}")
+            for cut, row in cuts.items():
+                nminusone = (f"{row['nminusone_events']:>12}{row['nminusone_weighted']:>14.2f}"
+                             if "nminusone_events" in row else "")
+                lines.append(f"  {cut:<24}{row['events']:>12}{row['weighted']:>14.2f}{row['efficiency']:>12.1%}{nminusone}")
+        return "\n".join(lines)
+#--------------------------------------------------
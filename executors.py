@@ -0,0 +1,64 @@
+##Execution backends for the coffea Runner.
+##
+##The analysis used to hardcode processor.IterativeExecutor(), which runs
+##every chunk on a single core.  This module collects the backends that
+##coffea 0.7 offers behind a single name, so the executor can be chosen
+##from the command line (or the EXECUTOR setting in the analysis script)
+##without touching the analysis code:
+##
+##   iterative : everything in the current process, one chunk at a time
+##   threads   : FuturesExecutor with a ThreadPoolExecutor of NUM_CORES threads
+##   processes : FuturesExecutor with a ProcessPoolExecutor of NUM_CORES processes
+##   dask      : DaskExecutor on a LocalCluster with NUM_CORES single-threaded workers
+import concurrent.futures
+import contextlib
+
+from coffea import processor
+
+
+EXECUTORS = ("iterative", "threads", "processes", "dask")
+
+
+#--------------------------------------------------
+@contextlib.contextmanager
+def executor_context(name, workers, status=True):
+    """Yield ``(executor, num_workers)`` for the backend called ``name``.
+
+    ``num_workers`` is the number of chunks that really run at the same
+    time, i.e. what the per-worker event rate has to be divided by.  For
+    the dask backend the local cluster is shut down on exit.
+    """
+    if name not in EXECUTORS:
+        raise ValueError(f"unknown executor '{name}', choose one of {', '.join(EXECUTORS)}")
+    workers = max(1, int(workers))
+
+    if name == "iterative":
+        yield processor.IterativeExecutor(status=status), 1
+
+    ##the pools are created here, not by every Runner call, so that a run split
+    ##in several Runner calls (e.g. with prefetching) starts its workers only once
+    elif name == "threads":
+        ##threads share the GIL, so this mostly helps when the job is I/O bound
+        ##(e.g. reading from root://eospublic.cern.ch)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            yield processor.FuturesExecutor(pool=pool, workers=workers, status=status), workers
+
+    elif name == "processes":
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            yield processor.FuturesExecutor(pool=pool, workers=workers, status=status), workers
+
+    elif name == "dask":
+        ##dask is optional, only import it when it is requested
+        try:
+            from distributed import Client, LocalCluster
+        except ImportError as err:
+            raise ImportError("the 'dask' executor needs dask.distributed: pip install dask distributed") from err
+
+        cluster = LocalCluster(n_workers=workers, threads_per_worker=1, processes=True)
+        client = Client(cluster)
+        try:
+            yield processor.DaskExecutor(client=client, status=status), workers
+        finally:
+            client.close()
+            cluster.close()
+#--------------------------------------------------
@@ -0,0 +1,155 @@
+##Persistent cache of per-file metadata (number of entries, UUID, cluster
+##boundaries) for the coffea Runner.
+##
+##Without it, every run has to open all input files before any physics runs:
+##once in the coffea "Preprocessing" step and once more to count the data
+##events.  Over XRootD (data/ntuples_remote.json) this is slow.  The cache is
+##a JSON file; an entry is reused as long as the file it describes has not
+##changed:
+##   * local files are identified by path, size and modification time,
+##   * remote files (root://...) by path alone, the open data files on EOS
+##     are never rewritten.  Use --refresh-metadata to force a refetch.
+##
+##A FileMetadataCache can be passed directly as metadata_cache to
+##processor.Runner.  When every file of the fileset is in the cache, the
+##Runner skips the preprocessing step entirely.
+import json
+import os
+from collections.abc import MutableMapping
+
+import uproot
+
+
+METADATA_CACHE = "metadata_cache.json"
+
+## the only keys coffea needs to build the chunks of a file.  User metadata
+## (process, xsec, ...) belongs to the dataset, not to the file, and is never
+## stored: ttbar and tttt read the same files with different metadata.
+FILE_KEYS = ("numentries", "uuid", "clusters")
+
+
+#--------------------------------------------------
+def local_path(filename):
+    """Return the local path of ``filename``, or None for remote files."""
+    if filename.startswith("file:"):
+        filename = filename[len("file:"):]
+    if "://" in filename:
+        return None
+    return filename
+
+
+def file_fingerprint(filename):
+    """Size and modification time of a local file (None for remote files)."""
+    path = local_path(filename)
+    if path is None:
+        return None
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+class FileMetadataCache(MutableMapping):
+    """JSON-backed mapping of ``(filename, treename)`` to file metadata.
+
+    Keys may also be coffea ``FileMeta`` objects, which is how the Runner
+    uses it.  In that case the user metadata of the ``FileMeta`` (process,
+    xsec, ...) is merged into the returned dictionary.
+    """
+
+    def __init__(self, path=METADATA_CACHE, refresh=False):
+        self.path = path
+        self._entries = {}
+        self._fingerprints = {}
+        self._dirty = False
+        if path and os.path.exists(path) and not refresh:
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def _key(key):
+        if isinstance(key, tuple):
+            return key
+        return (key.filename, key.treename)
+
+    def _fingerprint(self, filename):
+        ## stat every file only once per run, the Runner looks files up several times
+        if filename not in self._fingerprints:
+            try:
+                self._fingerprints[filename] = file_fingerprint(filename)
+            except OSError:
+                self._fingerprints[filename] = None
+        return self._fingerprints[filename]
+
+    def _entry(self, filename, treename):
+        entry = self._entries.get(filename, {}).get(treename)
+        if entry is None:
+            return None
+        if entry.get("fingerprint") != self._fingerprint(filename):
+            ## the file changed since it was cached
+            return None
+        return entry
+
+    def __getitem__(self, key):
+        filename, treename = self._key(key)
+        entry = self._entry(filename, treename)
+        if entry is None:
+            raise KeyError(key)
+        metadata = {}
+        if not isinstance(key, tuple) and key.metadata:
+            metadata.update({k: v for k, v in key.metadata.items() if k not in FILE_KEYS})
+        metadata["numentries"] = entry["numentries"]
+        metadata["uuid"] = bytes.fromhex(entry["uuid"])
+        if "clusters" in entry:
+            metadata["clusters"] = entry["clusters"]
+        return metadata
+
+    def __setitem__(self, key, metadata):
+        filename, treename = self._key(key)
+        entry = {"numentries": int(metadata["numentries"]),
+                 "uuid": bytes(metadata["uuid"]).hex(),
+                 "fingerprint": self._fingerprint(filename)}
+        if metadata.get("clusters") is not None:
+            entry["clusters"] = [int(c) for c in metadata["clusters"]]
+        self._entries.setdefault(filename, {})[treename] = entry
+        self._dirty = True
+
+    def __delitem__(self, key):
+        filename, treename = self._key(key)
+        del self._entries[filename][treename]
+        if not self._entries[filename]:
+            del self._entries[filename]
+        self._dirty = True
+
+    def __iter__(self):
+        for filename, trees in self._entries.items():
+            for treename in trees:
+                if self._entry(filename, treename) is not None:
+                    yield (filename, treename)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def num_entries(self, filename, treename="Events"):
+        """Number of entries of ``treename`` in ``filename``, opening the file only if needed."""
+        try:
+            return self[(filename, treename)]["numentries"]
+        except KeyError:
+            pass
+        with uproot.open(filename) as f:
+            tree = f[treename]
+            self[(filename, treename)] = {"numentries": tree.num_entries,
+                                          "uuid": f.file.fUUID,
+                                          "clusters": tree.common_entry_offsets()}
+        return self[(filename, treename)]["numentries"]
+
+    def save(self):
+        """Write the cache to disk if anything changed."""
+        if not self.path or not self._dirty:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp, self.path)
+        self._dirty = False
+#--------------------------------------------------
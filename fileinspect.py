@@ -0,0 +1,180 @@
+##Inspection of the files of an ntuples json.
+##
+##The "nevts" of the MC files in data/ntuples.json are typed in by hand, and
+##the MC normalization used them as the number of generated events, ignoring
+##negative generator weights.  inspect_ntuples() opens every file of every
+##process at the same time (a thread pool, so a long list of remote files costs
+##about as much as the slowest of them) and reads:
+##   * the number of entries of the Events tree (also stored in the metadata
+##     cache, so the Runner does not open the files again to preprocess them),
+##   * the number of generated events and the sum of generator weights
+##     (genEventCount and genEventSumw of the Runs tree, MC only).
+##It checks them against the json and writes a copy of it with the measured
+##values (by default data/ntuples_inspected.json next to the input):
+##   * "nevts" of every file is the number of generated events (the entries
+##     of the Events tree when there is no Runs tree, e.g. for data),
+##   * "sumw" of every MC file and "nevts_total" and "sumw_total" of every
+##     process and variation are added or corrected.
+##construct_fileset takes "sumw" from it, and the MC events are then weighted
+##with genWeight / sumw instead of 1 / nevts.
+##
+##The output json is also a cache: a file that is already in it, and did not
+##change (same size and modification time, for local files), is not opened
+##again unless refresh is set.
+##
+##   python fileinspect.py --ntuples data/ntuples_remote.json
+##   python coffeaAnalysisTemplate.py --ntuples data/ntuples_remote_inspected.json
+import argparse
+import concurrent.futures
+import copy
+import json
+import os
+import time
+
+import uproot
+
+from filecache import METADATA_CACHE, FileMetadataCache, file_fingerprint
+
+
+INSPECT_WORKERS = 16
+
+
+#--------------------------------------------------
+def inspect_file(filename, treename="Events"):
+    """Open one file, return the metadata of ``treename`` (as stored in the
+    metadata cache) plus the generator counts of the Runs tree, if any."""
+    with uproot.open(filename) as f:
+        tree = f[treename]
+        info = {"numentries": tree.num_entries, "uuid": f.file.fUUID,
+                "clusters": tree.common_entry_offsets()}
+        if "Runs" in f:
+            runs = f["Runs"]
+            for branch, key in (("genEventSumw", "sumw"), ("genEventCount", "gen_nevts")):
+                ## older NanoAOD versions have a trailing underscore
+                for name in (branch, branch + "_"):
+                    if name in runs:
+                        info[key] = runs[name].array(library="np").sum().item()
+                        break
+    return info
+
+
+def count_entries(paths, metadata_cache, treename="Events", workers=INSPECT_WORKERS):
+    """Entries of ``treename`` in every file; the files that are not in the
+    metadata cache yet are opened in parallel."""
+    todo = [path for path in paths if (path, treename) not in metadata_cache]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, info in zip(todo, pool.map(lambda path: inspect_file(path, treename), todo)):
+            metadata_cache[(path, treename)] = info
+    return {path: metadata_cache.num_entries(path, treename) for path in paths}
+
+
+def default_output(ntuples_json):
+    root, ext = os.path.splitext(ntuples_json)
+    return f"{root}_inspected{ext}"
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+def inspect_ntuples(ntuples_json, output_json=None, metadata_cache=None, workers=INSPECT_WORKERS, refresh=False):
+    """Inspect every file of ``ntuples_json`` and write ``output_json``.
+
+    Returns ``(output_json, warnings)``, the warnings being the values of
+    the input json that did not match the files.  Raises RuntimeError,
+    listing them, if some files cannot be read.
+    """
+    output_json = output_json or default_output(ntuples_json)
+    with open(ntuples_json) as f:
+        file_info = json.load(f)
+
+    paths = []
+    for variations in file_info.values():
+        for info in variations.values():
+            paths.extend(entry["path"] for entry in info["files"] if entry["path"] not in paths)
+
+    ## what an earlier inspection found, reused for the files that did not change
+    results = {}
+    if os.path.exists(output_json) and not refresh:
+        with open(output_json) as f:
+            for variations in json.load(f).values():
+                for info in variations.values():
+                    for entry in info["files"]:
+                        if "fingerprint" in entry:
+                            results[entry["path"]] = entry
+    fingerprints = {}
+    for path in paths:
+        try:
+            fingerprints[path] = file_fingerprint(path)
+        except OSError:
+            fingerprints[path] = "missing"
+    todo = [path for path in paths if path not in results or results[path]["fingerprint"] != fingerprints[path]]
+
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(inspect_file, path): path for path in todo}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                info = future.result()
+            except Exception as err:
+                errors[path] = f"{type(err).__name__}: {err}"
+                continue
+            if metadata_cache is not None:
+                metadata_cache[(path, "Events")] = info
+            results[path] = {"nevts": int(info.get("gen_nevts", info["numentries"])),
+                             "entries": info["numentries"], "sumw": info.get("sumw"),
+                             "fingerprint": fingerprints[path]}
+    if errors:
+        raise RuntimeError("cannot read:\n" + "\n".join(f"  {path}: {err}" for path, err in errors.items()))
+
+    warnings = []
+    out = copy.deepcopy(file_info)
+    for process, variations in out.items():
+        for variation, info in variations.items():
+            for entry in info["files"]:
+                found = results[entry["path"]]
+                if process != "data" and "nevts" in entry and entry["nevts"] != found["nevts"]:
+                    warnings.append(f"{process}/{variation}: {entry['path']} has {found['nevts']} generated events, "
+                                    f"the json says {entry['nevts']}")
+                entry.update(nevts=found["nevts"], entries=found["entries"], fingerprint=found["fingerprint"])
+                if found.get("sumw") is not None and process != "data":
+                    entry["sumw"] = found["sumw"]
+            if process == "data":
+                continue
+
+            nevts_total = sum(entry["nevts"] for entry in info["files"])
+            if "nevts_total" in info and info["nevts_total"] != nevts_total:
+                warnings.append(f"{process}/{variation}: nevts_total is {info['nevts_total']}, "
+                                f"the files have {nevts_total} generated events")
+            info["nevts_total"] = nevts_total
+            if all("sumw" in entry for entry in info["files"]):
+                info["sumw_total"] = sum(entry["sumw"] for entry in info["files"])
+            else:
+                warnings.append(f"{process}/{variation}: no genEventSumw in some files, "
+                                f"normalized with the number of events")
+
+    tmp = f"{output_json}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(out, f, indent=2)
+    os.replace(tmp, output_json)
+    return output_json, warnings
+#--------------------------------------------------
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the events and generator weights of every file of an ntuples json")
+    parser.add_argument("--ntuples", default="data/ntuples.json", help="input json (default: data/ntuples.json)")
+    parser.add_argument("--output", help="output json (default: <ntuples>_inspected.json)")
+    parser.add_argument("--workers", type=int, default=INSPECT_WORKERS,
+                        help=f"files opened at the same time (default: {INSPECT_WORKERS})")
+    parser.add_argument("--metadata-cache", default=METADATA_CACHE,
+                        help=f"metadata cache to fill for the Runner (default: {METADATA_CACHE})")
+    parser.add_argument("--refresh", action="store_true", help="open again the files that are already in the output")
+    args = parser.parse_args()
+
+    t0 = time.monotonic()
+    metadata_cache = FileMetadataCache(args.metadata_cache)
+    output, warnings = inspect_ntuples(args.ntuples, args.output, metadata_cache, args.workers, args.refresh)
+    metadata_cache.save()
+    for warning in warnings:
+        print(f"warning: {warning}")
+    print(f"wrote {output} ({time.monotonic() - t0:.1f} s)")
@@ -0,0 +1,59 @@
+##Fileset planning: read files shared by several processes only once.
+##
+##In data/ntuples.json the ttbar and tttt processes point to the same ROOT
+##files.  Given to the Runner as they are, the same bytes are read,
+##decompressed and selected twice.  plan_fileset() regroups the fileset so
+##that every physical file appears in exactly one dataset:
+##   * files used by a single dataset stay in that dataset,
+##   * files used by several datasets go to a combined dataset (named after
+##     the datasets, joined by "+") whose metadata has a "targets" list with
+##     the metadata of every dataset that claims the files.
+##TemplateAnalysis runs the selection once per chunk and fills the histograms
+##once per target, each with its own process and xsec weight, so the output
+##is the same as without planning.
+import os
+
+from filecache import local_path
+
+
+#--------------------------------------------------
+def plan_fileset(fileset, metadata_cache=None, treename="Events"):
+    """Return ``(planned_fileset, report)``.
+
+    ``report`` counts the shared files and the reads, entries and bytes
+    that are saved.  Entries are only counted when a ``metadata_cache``
+    (filecache.FileMetadataCache) is given, bytes only for local files.
+    """
+    ## which datasets claim every file, keeping the order of the fileset
+    claims = {}
+    for dataset, info in fileset.items():
+        for filename in info["files"]:
+            if dataset not in claims.setdefault(filename, []):
+                claims[filename].append(dataset)
+
+    planned = {}
+    report = {"shared_files": 0, "reads_saved": 0, "entries_saved": 0, "bytes_saved": 0}
+    for filename, datasets in claims.items():
+        if len(datasets) == 1:
+            dataset = datasets[0]
+            planned.setdefault(dataset, {"files": [], "metadata": fileset[dataset].get("metadata", {})})
+            planned[dataset]["files"].append(filename)
+            continue
+
+        name = "+".join(datasets)
+        if name not in planned:
+            targets = [dict(fileset[d].get("metadata", {}), dataset=d) for d in datasets]
+            planned[name] = {"files": [], "metadata": {"targets": targets}}
+        planned[name]["files"].append(filename)
+
+        extra_reads = len(datasets) - 1
+        report["shared_files"] += 1
+        report["reads_saved"] += extra_reads
+        if metadata_cache is not None:
+            report["entries_saved"] += extra_reads * metadata_cache.num_entries(filename, treename)
+        path = local_path(filename)
+        if path is not None and os.path.exists(path):
+            report["bytes_saved"] += extra_reads * os.path.getsize(path)
+
+    return planned, report
+#--------------------------------------------------
@@ -0,0 +1,200 @@
+##On-disk histogram format that can be read one slice at a time.
+##
+##histograms.pkl holds the whole ``hists`` dictionary in one pickle, so
+##drawing one plot means unpickling every histogram of every process and
+##variation.  save_histograms() writes instead a directory:
+##
+##   histograms/index.json            axes, storage and slices of every histogram
+##   histograms/<name>/<n>.npy        one slice: the dense axes (with flow bins)
+##                                    for one value of every category axis
+##
+##e.g. histograms/muon_pt/3.npy is the muon pt distribution of one process and
+##one variation.  Empty slices are not written.  HistDirectory reads the index
+##only; slice() memory-maps the single .npy file it needs and returns a small
+##hist.Hist with the dense axes, so plot.py reads just what it draws.
+##HistDirectory["muon_pt"] still rebuilds the full histogram when needed.
+##load_histograms() also accepts a legacy histograms.pkl.
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from collections.abc import Mapping
+
+import hist
+import numpy as np
+
+
+HIST_DIR = "histograms"
+FORMAT_VERSION = 1
+
+CATEGORY_AXES = (hist.axis.StrCategory, hist.axis.IntCategory)
+
+
+#--------------------------------------------------
+def axis_to_dict(axis):
+    """JSON description of a hist axis, enough to rebuild it with axis_from_dict."""
+    ## axis.label falls back to the name when no label was given, the metadata does not
+    desc = {"type": type(axis).__name__, "name": axis.name, "label": axis.__dict__.get("label", "")}
+    if isinstance(axis, CATEGORY_AXES):
+        desc.update(categories=list(axis), growth=axis.traits.growth)
+    elif isinstance(axis, hist.axis.Regular) and axis.transform is None:
+        desc.update(bins=axis.size, start=float(axis.edges[0]), stop=float(axis.edges[-1]),
+                    underflow=axis.traits.underflow, overflow=axis.traits.overflow)
+    elif isinstance(axis, hist.axis.Variable):
+        desc.update(edges=axis.edges.tolist(), underflow=axis.traits.underflow, overflow=axis.traits.overflow)
+    elif isinstance(axis, hist.axis.Integer):
+        desc.update(start=int(axis.edges[0]), stop=int(axis.edges[-1]),
+                    underflow=axis.traits.underflow, overflow=axis.traits.overflow)
+    else:
+        raise TypeError(f"cannot store a {type(axis).__name__} axis ({axis.name})")
+    return desc
+
+
+def axis_from_dict(desc):
+    kwargs = {"name": desc["name"], "label": desc["label"]}
+    kind = desc["type"]
+    if kind in ("StrCategory", "IntCategory"):
+        return getattr(hist.axis, kind)(desc["categories"], growth=desc["growth"], **kwargs)
+    kwargs.update(underflow=desc["underflow"], overflow=desc["overflow"])
+    if kind == "Regular":
+        return hist.axis.Regular(desc["bins"], desc["start"], desc["stop"], **kwargs)
+    if kind == "Variable":
+        return hist.axis.Variable(desc["edges"], **kwargs)
+    if kind == "Integer":
+        return hist.axis.Integer(desc["start"], desc["stop"], **kwargs)
+    raise TypeError(f"unknown axis type {kind}")
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+def _is_empty(data):
+    ## Weight and Mean storages are structured arrays (value, variance, ...)
+    if data.dtype.names:
+        return not any(data[field].any() for field in data.dtype.names)
+    return not data.any()
+
+
+def save_histograms(hists, directory=HIST_DIR):
+    """Write a dictionary of hist.Hist to ``directory``, replacing what was there.
+
+    The new directory is written next to the old one and swapped in at the
+    end, so an interrupted save leaves the previous histograms intact.
+    """
+    tmp = directory.rstrip("/") + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    index = {"format": FORMAT_VERSION, "hists": {}}
+    for name, h in hists.items():
+        os.makedirs(os.path.join(tmp, name))
+        cat_pos = [i for i, axis in enumerate(h.axes) if isinstance(axis, CATEGORY_AXES)]
+        entry = {"axes": [axis_to_dict(axis) for axis in h.axes],
+                 "storage": h.storage_type.__name__, "slices": []}
+        view = h.view(flow=True)
+        ## category axes have no underflow bin, so bin i of the view is category i
+        for bins in np.ndindex(*(len(h.axes[i]) for i in cat_pos)):
+            idx = [slice(None)] * h.ndim
+            for pos, i in zip(cat_pos, bins):
+                idx[pos] = i
+            data = np.ascontiguousarray(view[tuple(idx)])
+            if _is_empty(data):
+                continue
+            filename = f"{name}/{len(entry['slices'])}.npy"
+            np.save(os.path.join(tmp, filename), data)
+            entry["slices"].append({"categories": [h.axes[pos][i] for pos, i in zip(cat_pos, bins)],
+                                    "file": filename, "sha1": hashlib.sha1(data.tobytes()).hexdigest()})
+        index["hists"][name] = entry
+
+    with open(os.path.join(tmp, "index.json"), "w") as f:
+        json.dump(index, f, indent=1)
+
+    if os.path.exists(directory):
+        old = directory.rstrip("/") + ".old"
+        os.replace(directory, old)
+        os.replace(tmp, directory)
+        shutil.rmtree(old)
+    else:
+        os.replace(tmp, directory)
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+class HistDirectory(Mapping):
+    """Histograms written by save_histograms. Nothing but the index is read up front."""
+
+    def __init__(self, directory=HIST_DIR):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+        if index.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{directory}: unsupported histogram format {index.get('format')}")
+        self.index = index["hists"]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return f"HistDirectory({self.directory!r}, hists={list(self.index)})"
+
+    def __getitem__(self, name):
+        """The full histogram ``name``, with every slice loaded."""
+        entry = self.index[name]
+        h = hist.Hist(*(axis_from_dict(desc) for desc in entry["axes"]),
+                      storage=getattr(hist.storage, entry["storage"])())
+        cat_pos = [i for i, axis in enumerate(h.axes) if isinstance(axis, CATEGORY_AXES)]
+        view = h.view(flow=True)
+        for piece in entry["slices"]:
+            idx = [slice(None)] * h.ndim
+            for pos, value in zip(cat_pos, piece["categories"]):
+                idx[pos] = h.axes[pos].index(value)
+            view[tuple(idx)] = self._load(piece)
+        return h
+
+    def _load(self, piece):
+        return np.load(os.path.join(self.directory, piece["file"]), mmap_mode="r")
+
+    def categories(self, name):
+        """Category values of every category axis of ``name``, by axis name."""
+        return {desc["name"]: desc["categories"] for desc in self.index[name]["axes"] if "categories" in desc}
+
+    def slice(self, name, **categories):
+        """Histogram of the dense axes of ``name`` for one value of every category axis.
+
+        E.g. ``slice("muon_pt", process="data", variation="nominal")``. Only
+        that slice is read from disk.
+        """
+        entry = self.index[name]
+        known = self.categories(name)
+        if set(categories) != set(known):
+            raise TypeError(f"{name}: give one value for each of {sorted(known)}")
+        for axis, value in categories.items():
+            if value not in known[axis]:
+                raise KeyError(f"{name}: {value!r} is not a category of the {axis} axis")
+
+        dense = [axis_from_dict(desc) for desc in entry["axes"] if "categories" not in desc]
+        h = hist.Hist(*dense, storage=getattr(hist.storage, entry["storage"])())
+        wanted = [categories[desc["name"]] for desc in entry["axes"] if "categories" in desc]
+        for piece in entry["slices"]:
+            if piece["categories"] == wanted:
+                h.view(flow=True)[...] = self._load(piece)
+                break
+        return h
+
+    def fingerprint(self, name):
+        """Changes whenever the content (or binning) of histogram ``name`` changes."""
+        return hashlib.sha1(json.dumps(self.index[name], sort_keys=True).encode()).hexdigest()
+#--------------------------------------------------
+
+
+def load_histograms(path=HIST_DIR):
+    """A HistDirectory for a directory written by save_histograms, or the
+    dictionary of a legacy histograms.pkl."""
+    if os.path.isdir(path):
+        return HistDirectory(path)
+    with open(path, "rb") as f:
+        return pickle.load(f)
@@ -1,3 +1,6 @@
+import argparse
+import concurrent.futures
+import hashlib
 import os
 import time
 
@@ -8,25 +11,98 @@ import mplhep as hep
 from hist.intervals import ratio_uncertainty
 import matplotlib as mpl
 import numpy as np
-import pickle
-from collections import OrderedDict 
+from collections import OrderedDict
+
+from histfile import HIST_DIR, HistDirectory, load_histograms
+
+HISTOGRAMS = HIST_DIR
+## written by coffeaAnalysisTemplate.py --pickle (and by older versions)
+LEGACY_HISTOGRAMS = "histograms.pkl"
+PLOT_DIR = "plots"
+
+### list of bkgs to plot
+dictBkgs = OrderedDict()
+dictBkgs["ttbar"] = { "color" : "#80ff00", "label" : "$t\\bar{t}$" }
+dictBkgs["wjets"] = { "color" : "#ff9f00", "label" : "EW" }
+dictBkgs["dyjets"] = { "color" : "#007fff", "label" : "EW" }
+
+bkgs = list(dictBkgs.keys())[::-1]
+bkgs_colors = [ col["color"] for i, col in dictBkgs.items() ]
+bkgs_label = [ col["label"] for i, col in dictBkgs.items() ]
+
+### settings of every histogram produced by TemplateAnalysis, used by the batch mode
+PLOTS = OrderedDict()
+PLOTS["muon_pt"]  = dict(xlabel="Muon $p_{T}$ [GeV]", rebinFactor=7, xmin=20j, xmax=300j)
+PLOTS["muon_eta"] = dict(xlabel="Muon $\\eta$", rebinFactor=2, xmin=-2.5j, xmax=2.5j)
+PLOTS["nmuons"]   = dict(xlabel="Number of muons", rebinFactor=1, xmin=0j, xmax=10j)
+PLOTS["jets_pt"]  = dict(xlabel="Jet $p_{T}$ [GeV]", rebinFactor=7, xmin=20j, xmax=300j)
+PLOTS["jets_eta"] = dict(xlabel="Jet $\\eta$", rebinFactor=2, xmin=-5j, xmax=5j)
+PLOTS["njets"]    = dict(xlabel="Number of jets", rebinFactor=1, xmin=0j, xmax=15j)
+PLOTS["nbjets"]   = dict(xlabel="Number of b-jets", rebinFactor=1, xmin=0j, xmax=10j)
+
+
+#---------------------Histogram store with memoized projections
+class HistStore:
+    """The histograms to plot, with every rebinned and sliced projection
+    computed only once: plotHisto needs the same background projections for
+    the stack and for the total.
+
+    ``hists`` is a histfile.HistDirectory, of which only the slices that are
+    drawn get read, or the dictionary of a legacy histograms.pkl."""
+
+    def __init__(self, hists, path=None):
+        self.hists = hists
+        self.path = path
+        self._projections = {}
+
+    @classmethod
+    def load(cls, path=HISTOGRAMS):
+        if path == HISTOGRAMS and not os.path.exists(path) and os.path.exists(LEGACY_HISTOGRAMS):
+            path = LEGACY_HISTOGRAMS
+        return cls(load_histograms(path), path)
+
+    def keys(self):
+        return self.hists.keys()
+
+    def projection(self, histName, proc, xmin, xmax, rebinFactor, variation="nominal"):
+        key = (histName, proc, xmin, xmax, rebinFactor, variation)
+        if key not in self._projections:
+            if isinstance(self.hists, HistDirectory):
+                h = self.hists.slice(histName, process=proc, variation=variation)
+                self._projections[key] = h[ xmin:xmax:hist.rebin(rebinFactor)]
+            else:
+                self._projections[key] = self.hists[histName][ xmin:xmax:hist.rebin(rebinFactor), proc, variation]
+        return self._projections[key]
+
+    def fingerprint(self, histName):
+        """Changes when the content of histName changes. For a legacy pickle
+        this is the hash of the whole file."""
+        if isinstance(self.hists, HistDirectory):
+            return self.hists.fingerprint(histName)
+        return file_sha1(self.path)
+#-----------------------------------
 
-#---------------------Plotting function with CMS style
-def plotHisto( thehist, thebkgs, histName = "muon_pt", xlabel = "Muon $p_{T}$ [GeV]", rebinFactor = 7, 
-                  xmin = 20j, xmax = 300j, mcFactor = 1, xlog=False):
 
-    data = thehist[histName][ xmin:xmax:hist.rebin(rebinFactor), "data", "nominal"]
-    hists = [] 
+#---------------------Plotting function with CMS style
+# If output is given the figure is saved there instead of being shown
+def plotHisto( thehist, thebkgs, histName = "muon_pt", xlabel = "Muon $p_{T}$ [GeV]", rebinFactor = 7,
+                  xmin = 20j, xmax = 300j, mcFactor = 1, xlog=False, output=None):
+    if not isinstance(thehist, HistStore):
+        thehist = HistStore(thehist)
+
+    data = thehist.projection(histName, "data", xmin, xmax, rebinFactor)
+    hists = []
     tot = data.copy()
     tot.reset()
 
     for ibkg in thebkgs:
-        hists.append( (mcFactor*thehist[histName][ xmin:xmax:hist.rebin(rebinFactor), ibkg, "nominal"]) )
-        tot += (mcFactor*thehist[histName][ xmin:xmax:hist.rebin(rebinFactor), ibkg, "nominal"])
-        
+        bkg = mcFactor*thehist.projection(histName, ibkg, xmin, xmax, rebinFactor)
+        hists.append( bkg )
+        tot += bkg
+
     #note that the signal dataset name is harcoded here
-    signal = 40*thehist[histName][ xmin:xmax:hist.rebin(rebinFactor), "tttt", "nominal"]
-        
+    signal = 40*thehist.projection(histName, "tttt", xmin, xmax, rebinFactor)
+
     fig, (ax, rax) = plt.subplots(2, 1, gridspec_kw=dict(height_ratios=[3, 1], hspace=0.03), sharex=True)
     #the labels are harcoded and it is for 2015
     hep.cms.label("Open Data", ax=ax, data=True, lumi=2.26, year=2015) #, rlabel="2.3 $\mathrm{fb^{-1}}$, 2015 (8 TeV)")
@@ -45,22 +121,22 @@ def plotHisto( thehist, thebkgs, histName = "muon_pt", xlabel = "Muon $p_{T}$ [G
     ax.set_ylim(0.1, 1e5)
     ax.legend()
     ax.set_ylabel(f"Events / {rebinFactor}")
-    
+
     yerr = ratio_uncertainty(data.values(), tot.values(), 'poisson')
     rax.stairs(1+yerr[1], edges=tot.axes[0].edges, baseline=1-yerr[0], **errps)
     hep.histplot(data.values()/tot.values(), tot.axes[0].edges, yerr=np.sqrt(data.values())/tot.values(),
         ax=rax, histtype='errorbar', color='k', capsize=4, label="Data")
-    
+
     # Set the number of y ticks
     ax.set_yticks([1e-1,1,1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8])
-    
+
     # Set the number of x ticks
     if histName == "muon_pt":
         ax.set_xticks([20, 50, 100, 150, 200, 250, 300])
-        
+
     if histName == "njets":
         ax.set_xticks([4,5,6, 7, 8, 9, 10, 11, 12, 13, 14, 15])
-        
+
     if histName == "htb":
         ax.set_xticks([100, 200, 300, 400, 500, 600, 700, 800, 900, 1000])
 
@@ -69,28 +145,97 @@ def plotHisto( thehist, thebkgs, histName = "muon_pt", xlabel = "Muon $p_{T}$ [G
     ### more labels
     plt.xlabel(xlabel)
     plt.ylabel("Data/MC")
-    plt.show()
+    if output is None:
+        plt.show()
+    else:
+        fig.savefig(output)
+        plt.close(fig)
 #-----------------------------------
 
 
-with open("histograms.pkl", "rb") as f:
-    h2 = pickle.load(f)
-    print(h2)
-    print(h2.keys())
-
-
-    ### list of bkgs to plot
-    dictBkgs = OrderedDict()
-    dictBkgs["ttbar"] = { "color" : "#80ff00", "label" : "$t\\bar{t}$" }
-    dictBkgs["wjets"] = { "color" : "#ff9f00", "label" : "EW" }
-    dictBkgs["dyjets"] = { "color" : "#007fff", "label" : "EW" }
-
-    bkgs = list(dictBkgs.keys())[::-1]
-    print(bkgs)
-    bkgs_colors = [ col["color"] for i, col in dictBkgs.items() ]
-    print(bkgs_colors)
-    bkgs_label = [ col["label"] for i, col in dictBkgs.items() ]
-
-    plotHisto(h2,bkgs,xlog=True)
+#---------------------Batch mode
+# Every histogram of PLOTS that is in the store is drawn to a file by a pool
+# of worker processes. Each worker opens the store once. A plot is only drawn
+# again if its histogram, its settings or this script changed since the last
+# time (the fingerprints are kept in <outdir>/plot_cache.json).
+_store = None
+
+def _init_worker(path):
+    global _store
+    plt.switch_backend("Agg")
+    _store = HistStore.load(path)
+
+def _draw(histName, output):
+    plotHisto(_store, bkgs, histName=histName, output=output, **PLOTS[histName])
+    return histName
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def plot_all(path=HISTOGRAMS, outdir=PLOT_DIR, fmt="png", workers=None, force=False):
+    os.makedirs(outdir, exist_ok=True)
+    cache_file = os.path.join(outdir, "plot_cache.json")
+    cache = {}
+    if os.path.exists(cache_file) and not force:
+        with open(cache_file) as f:
+            cache = json.load(f)
+
+    store = HistStore.load(path)
+    script = file_sha1(__file__)
+
+    todo = {}
+    for histName in PLOTS:
+        if histName not in store.keys():
+            print(f"{histName} is not in {path}, skipping it")
+            continue
+        output = os.path.join(outdir, f"{histName}.{fmt}")
+        key = f"{store.fingerprint(histName)}/{script}/{PLOTS[histName]}"
+        if cache.get(output) == key and os.path.exists(output):
+            print(f"{output} is up to date")
+            continue
+        todo[histName] = (output, key)
+
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(path,)) as pool:
+            futures = {pool.submit(_draw, histName, output): histName for histName, (output, _) in todo.items()}
+            for future in concurrent.futures.as_completed(futures):
+                histName = future.result()
+                output, key = todo[histName]
+                cache[output] = key
+                print(f"wrote {output}")
+
+    with open(cache_file, "w") as f:
+        json.dump(cache, f, indent=1)
+#-----------------------------------
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot the histograms produced by coffeaAnalysisTemplate.py")
+    parser.add_argument("--input", default=HISTOGRAMS,
+                        help=f"histogram directory, or a legacy pickle file (default: {HISTOGRAMS}, "
+                             f"falling back to {LEGACY_HISTOGRAMS})")
+    parser.add_argument("--batch", action="store_true",
+                        help="draw every histogram to a file instead of showing muon_pt")
+    parser.add_argument("--outdir", default=PLOT_DIR, help=f"directory for the batch plots (default: {PLOT_DIR})")
+    parser.add_argument("--format", default="png", help="file format of the batch plots (default: png)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes of the batch mode (default: all cores)")
+    parser.add_argument("--force", action="store_true", help="redraw plots that are up to date")
+    args = parser.parse_args()
+
+    if args.batch:
+        t0 = time.monotonic()
+        plot_all(args.input, args.outdir, args.format, args.workers, args.force)
+        print(f"done in {time.monotonic() - t0:.1f} s")
+    else:
+        h2 = HistStore.load(args.input)
+        print(h2.hists)
+        print(h2.keys())
+        print(bkgs)
+        print(bkgs_colors)
+
+        plotHisto(h2,bkgs,xlog=True)
@@ -0,0 +1,188 @@
+##Read-ahead of remote input files (root://eospublic.cern.ch, ...).
+##
+##With remote inputs every chunk waits for its baskets to come over the
+##network before it can be processed.  The Prefetcher copies, in background
+##threads, the branches the processor needs (TemplateAnalysis.columns) of the
+##next chunks into small local ROOT files while the current chunks are being
+##processed, and hands the Runner work items that point to those local copies:
+##
+##   prefetcher = Prefetcher(analysis.columns, depth=8)
+##   for batch in prefetcher.batches(chunks, num_workers):
+##       out, metrics = run(batch, "Events", processor_instance=analysis)
+##       prefetcher.release(batch)
+##
+##At most ``depth`` chunks are fetched ahead of the ones being processed, so
+##the local disk use stays bounded.  The local copies are deleted once their
+##chunk is processed, unless a disk cache size is given (``cache_mb``): then
+##they are kept, and the least recently used ones are deleted when the cache
+##grows beyond that size, so rerunning on the same chunks does not go to the
+##network again.
+##
+##Local files are processed directly, they gain nothing from a copy.  To try
+##the prefetching without network access, ``latency`` makes local files behave
+##like remote ones: they are prefetched too, and every read request of the
+##prefetcher waits ``latency`` seconds (see DelayedFileSource).
+##
+##report() gives the time spent fetching, the time the processing had to wait
+##for a chunk that was not ready yet (the stall) and the difference, the I/O
+##time that was hidden behind the processing.
+import collections
+import concurrent.futures
+import glob
+import hashlib
+import os
+import threading
+import time
+
+import uproot
+from coffea.processor.executor import WorkItem
+
+from filecache import local_path
+
+
+PREFETCH_DIR = "prefetch"
+
+
+#--------------------------------------------------
+class DelayedFileSource(uproot.source.file.MemmapSource):
+    """Local file source that waits ``latency`` seconds per read request,
+    a file-backed stand-in for an XRootD server."""
+
+    latency = 0.
+
+    def chunk(self, start, stop):
+        time.sleep(self.latency)
+        return super().chunk(start, stop)
+
+    def chunks(self, ranges, notifications):
+        time.sleep(self.latency)
+        return super().chunks(ranges, notifications)
+
+
+def delayed_file_source(latency):
+    """DelayedFileSource subclass with the given latency, to pass as uproot's file_handler."""
+    return type("DelayedFileSource", (DelayedFileSource,), {"latency": latency})
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+class Prefetcher:
+    """Fetches the needed branches of upcoming chunks to local files, see above."""
+
+    def __init__(self, columns, directory=PREFETCH_DIR, depth=4, fetchers=2, cache_mb=0, latency=0.):
+        self.columns = list(columns)
+        self.directory = os.path.abspath(directory)
+        self.depth = max(1, depth)
+        self.fetchers = max(1, fetchers)
+        self.cache_bytes = cache_mb * 1000**2
+        self.latency = latency
+        self.open_options = {"file_handler": delayed_file_source(latency)} if latency > 0 else {}
+        ## local copies being fetched or processed, never evicted from the cache
+        self._in_use = set()
+        self._lock = threading.Lock()
+        self._stats = {"chunks": 0, "cache_hits": 0, "bytes": 0, "fetch_time_s": 0., "stall_s": 0.}
+        os.makedirs(self.directory, exist_ok=True)
+        for tmp in glob.glob(os.path.join(self.directory, "*.tmp")):
+            os.remove(tmp)
+
+    def wanted(self, item):
+        """Whether the chunk is worth a local copy."""
+        return self.latency > 0 or local_path(item.filename) is None
+
+    def path(self, item):
+        key = "\n".join(map(str, (item.dataset, item.filename, item.fileuuid.hex(), item.treename,
+                                  item.entrystart, item.entrystop, sorted(self.columns))))
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".root")
+
+    def fetch(self, item):
+        """Copy the columns of one chunk to a local file, return the WorkItem that reads it."""
+        path = self.path(item)
+        with self._lock:
+            self._in_use.add(path)
+        t0 = time.monotonic()
+        if os.path.exists(path):
+            ## disk cache hit, mark it as recently used
+            os.utime(path)
+            with self._lock:
+                self._stats["cache_hits"] += 1
+        else:
+            ## to_writable lives with the skim, which reads and writes branches the same way
+            from skim import to_writable
+
+            with uproot.open(item.filename, **self.open_options) as f:
+                tree = f[item.treename]
+                ## data has no generator branches (genWeight)
+                columns = [name for name in self.columns if name in tree]
+                arrays = tree.arrays(columns, entry_start=item.entrystart, entry_stop=item.entrystop)
+            tmp = f"{path}.tmp"
+            with uproot.recreate(tmp) as out:
+                out[item.treename] = to_writable(arrays, columns)
+            os.replace(tmp, path)
+            with self._lock:
+                self._stats["fetch_time_s"] += time.monotonic() - t0
+                self._stats["bytes"] += os.path.getsize(path)
+        with self._lock:
+            self._stats["chunks"] += 1
+
+        ## the checkpoints (checkpoint.py) are still named after the original chunk
+        usermeta = dict(item.usermeta or {}, prefetched={"filename": item.filename, "entrystart": item.entrystart,
+                                                         "entrystop": item.entrystop})
+        return WorkItem(item.dataset, path, item.treename, 0, item.entrystop - item.entrystart,
+                        item.fileuuid, usermeta)
+
+    def batches(self, chunks, batch_size):
+        """Yield the chunks in lists of ``batch_size``, with the wanted ones replaced
+        by their local copies. Up to ``depth`` further chunks are fetched meanwhile."""
+        chunks = iter(chunks)
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.fetchers) as pool:
+            def fill():
+                while len(pending) < batch_size + self.depth:
+                    item = next(chunks, None)
+                    if item is None:
+                        return
+                    if self.wanted(item):
+                        pending.append(pool.submit(self.fetch, item))
+                    else:
+                        done = concurrent.futures.Future()
+                        done.set_result(item)
+                        pending.append(done)
+
+            fill()
+            while pending:
+                t0 = time.monotonic()
+                batch = [pending.popleft().result() for _ in range(min(batch_size, len(pending)))]
+                with self._lock:
+                    self._stats["stall_s"] += time.monotonic() - t0
+                ## keep reading ahead while this batch is processed
+                fill()
+                yield batch
+
+    def release(self, batch):
+        """Called once ``batch`` is processed: delete its local copies, or keep
+        them in the disk cache and shrink the cache to its size."""
+        copies = [item.filename for item in batch if item.filename.startswith(self.directory)]
+        with self._lock:
+            self._in_use.difference_update(copies)
+        if not self.cache_bytes:
+            for path in copies:
+                os.remove(path)
+            return
+
+        files = sorted(glob.glob(os.path.join(self.directory, "*.root")), key=os.path.getmtime)
+        size = sum(os.path.getsize(path) for path in files)
+        for path in files:
+            if size <= self.cache_bytes:
+                break
+            with self._lock:
+                in_use = path in self._in_use
+            if not in_use:
+                size -= os.path.getsize(path)
+                os.remove(path)
+
+    def report(self):
+        """Chunks and bytes fetched, time spent fetching, waiting, and hidden."""
+        report = dict(self._stats)
+        report["hidden_s"] = max(0., report["fetch_time_s"] - report["stall_s"])
+        return report
+#--------------------------------------------------
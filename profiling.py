@@ -0,0 +1,136 @@
+##Opt-in stage-level profiling of TemplateAnalysis.process.
+##
+##process() calls ``profiler.lap(name, events_in, events_out)`` at the end of
+##each of its steps (event filter, object selection, event selection, each
+##histogram fill, ...).  When profiling is enabled this charges the time since
+##the previous lap to that stage and counts the events going in (and, for
+##selections, coming out).  At the end of every chunk the resident memory of
+##the worker is recorded too.  The result is a StageProfile, a coffea
+##accumulator, so it is merged across chunks and workers like the histograms
+##and can be printed next to the Runner metrics.
+##
+##NanoEvents reads branches lazily: the time to read and decompress a branch
+##is charged to the first stage that uses it.
+import resource
+import sys
+import time
+
+from coffea import processor
+
+
+#--------------------------------------------------
+def current_rss_mb():
+    """Resident memory of this process in MB (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 1024**2
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 1024**2 if sys.platform == "darwin" else maxrss / 1024
+
+
+def reset_peak_rss():
+    """Restart the peak RSS measurement of high_water_rss_mb (Linux only).
+
+    Returns False where the peak cannot be reset: the peak is then the one
+    of the whole life of the process.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def high_water_rss_mb():
+    """Peak resident memory in MB since the last reset_peak_rss (or since the start)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024**2 if sys.platform == "darwin" else maxrss / 1024
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+class StageProfile(processor.AccumulatorABC):
+    """Time and event counts per stage, plus per-chunk memory, summed over chunks."""
+
+    def __init__(self):
+        ## name -> {"time": seconds, "calls": n, "events_in": n, "events_out": n}
+        self.stages = {}
+        self.chunks = 0
+        self.rss_sum_mb = 0.
+        self.rss_max_mb = 0.
+
+    def identity(self):
+        return StageProfile()
+
+    def add(self, other):
+        for name, stage in other.stages.items():
+            mine = self.stages.setdefault(name, {"time": 0., "calls": 0, "events_in": 0, "events_out": 0})
+            for key, value in stage.items():
+                mine[key] += value
+        self.chunks += other.chunks
+        self.rss_sum_mb += other.rss_sum_mb
+        self.rss_max_mb = max(self.rss_max_mb, other.rss_max_mb)
+
+    def summary(self):
+        """Plain dictionary with the rates, e.g. to store in the Runner metrics."""
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = dict(stage, rate_kHz=stage["events_in"] / stage["time"] / 1_000 if stage["time"] else 0.)
+        return {"stages": stages, "chunks": self.chunks,
+                "rss_mean_mb": self.rss_sum_mb / self.chunks if self.chunks else 0.,
+                "rss_max_mb": self.rss_max_mb}
+
+    def __str__(self):
+        total = sum(stage["time"] for stage in self.stages.values())
+        lines = [f"{'stage':<28}{'time [s]':>10}{'share':>8}{'events in':>12}{'events out':>12}{'rate [kHz]':>12}"]
+        for name, stage in self.summary()["stages"].items():
+            share = stage["time"] / total if total else 0.
+            lines.append(f"{name:<28}{stage['time']:>10.3f}{share:>8.1%}{stage['events_in']:>12}"
+                         f"{stage['events_out']:>12}{stage['rate_kHz']:>12.1f}")
+        summary = self.summary()
+        lines.append(f"{self.chunks} chunks, worker RSS at the end of a chunk: "
+                     f"mean {summary['rss_mean_mb']:.1f} MB, max {summary['rss_max_mb']:.1f} MB")
+        return "\n".join(lines)
+#--------------------------------------------------
+
+
+#--------------------------------------------------
+class StageProfiler:
+    """Measures the stages of one chunk. Does nothing if ``enabled`` is False."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.profile = StageProfile()
+        self._last = time.perf_counter()
+
+    def lap(self, name, events_in, events_out=0):
+        """Charge the time since the previous lap (or since the start) to stage ``name``."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        stage = self.profile.stages.setdefault(name, {"time": 0., "calls": 0, "events_in": 0, "events_out": 0})
+        stage["time"] += now - self._last
+        stage["calls"] += 1
+        stage["events_in"] += events_in
+        stage["events_out"] += events_out
+        self._last = now
+
+    def finish(self):
+        """Record the memory at the end of the chunk and return the StageProfile."""
+        if self.enabled:
+            rss = current_rss_mb()
+            self.profile.chunks += 1
+            self.profile.rss_sum_mb += rss
+            self.profile.rss_max_mb = max(self.profile.rss_max_mb, rss)
+        return self.profile
+#--------------------------------------------------
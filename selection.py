@@ -0,0 +1,87 @@
+##Staged, cut-ordered event selection for TemplateAnalysis.process.
+##
+##Every event-level cut is applied as soon as it is known, so the objects
+##needed by the next cuts (muons, then jets, electrons, ...) are only built
+##and masked for the events that survived the previous ones:
+##
+##   selection = StagedSelection(events, profiler)
+##   selection.require("primary vertex", selection.events.PV.npvsGood >= 1)
+##   muons = selection.events.Muon[selection.events.Muon.pt > 5]
+##   muons = selection.require("one muon", ak.num(muons) == 1, muons)
+##   jets = selection.events.Jet          # only for events with one muon
+##
+##Cuts on flat event branches (PV, HLT, MET, ...) are cheap and should come
+##first, cuts that need a collection after them.  Consecutive requirements
+##compose: each one is a mask over the events that passed the ones before.
+##The number of events after every cut is kept in ``steps``, and the number
+##and sum of weights (``weight``, e.g. the genWeight) in ``yields``.
+##
+##N-1 yields (the events passing every cut but one) need the later cuts to
+##be evaluated on the events that failed an earlier one, which the staging
+##drops.  With ``nminusone=True`` the events that failed exactly one cut are
+##kept aside, and every later cut is applied to them too.  The cuts then have
+##to be given as a function of the events instead of a mask:
+##
+##   selection.require("primary vertex", lambda events: events.PV.npvsGood >= 1)
+##
+##(a function works without nminusone as well).  See cutflow.py.
+import awkward as ak
+
+
+#--------------------------------------------------
+class StagedSelection:
+    """The events surviving the cuts required so far."""
+
+    def __init__(self, events, profiler=None, weight=None, nminusone=False):
+        self.events = events
+        self.profiler = profiler
+        ## function of the events returning one weight per event, None counts events
+        self.weight = weight
+        self.nminusone = nminusone
+        ## (cut name, events before, events after), in the order they were required
+        self.steps = []
+        ## (cut name, events after, sum of weights after), starting with all events
+        self.yields = [("all events",) + self._count(events)]
+        ## cut name -> the events that failed this cut only, with nminusone
+        self.failed_only = {}
+
+    def _count(self, events):
+        sumw = float(ak.sum(self.weight(events))) if self.weight is not None else float(len(events))
+        return len(events), sumw
+
+    def require(self, name, mask, *collections):
+        """Keep the events where ``mask`` is True.
+
+        ``mask`` is one boolean per event still selected, or a function of
+        the events returning it (needed with nminusone).  The given
+        collections, built for the same events, are returned with the
+        same mask applied (the collection itself if only one is given).
+        """
+        cut = mask if callable(mask) else None
+        if cut is None and self.nminusone:
+            raise ValueError(f"cut '{name}': N-1 yields need the cut as a function of the events, not a mask")
+        mask = ak.fill_none(cut(self.events) if cut else mask, False)
+
+        if self.nminusone:
+            for failed, events in self.failed_only.items():
+                self.failed_only[failed] = events[ak.fill_none(cut(events), False)]
+            self.failed_only[name] = self.events[~mask]
+
+        before = len(self.events)
+        self.events = self.events[mask]
+        self.steps.append((name, before, len(self.events)))
+        self.yields.append((name,) + self._count(self.events))
+        if self.profiler is not None:
+            self.profiler.lap(name, before, len(self.events))
+        masked = tuple(collection[mask] for collection in collections)
+        return masked[0] if len(masked) == 1 else masked
+
+    def nminusone_yields(self):
+        """cut name -> (events, sum of weights) passing every cut but that one."""
+        events, sumw = self._count(self.events)
+        yields = {}
+        for name, failed in self.failed_only.items():
+            n, w = self._count(failed)
+            yields[name] = (events + n, sumw + w)
+        return yields
+#--------------------------------------------------
@@ -0,0 +1,177 @@
+##Skimming stage: writes slim local copies of the NanoAOD input files.
+##
+##TemplateAnalysis only reads a handful of branches (TemplateAnalysis.columns)
+##and only keeps events with exactly one muon above MUON_PT_MIN.  This script
+##reads those branches only, drops the events that fail the muon requirement
+##and writes what is left to a small ROOT file per input file.  It also writes
+##an ntuples json (default data/ntuples_skim.json) with the same structure as
+##the input one, pointing to the skimmed files, so the analysis can run on it:
+##
+##   python skim.py --ntuples data/ntuples.json
+##   python coffeaAnalysisTemplate.py --ntuples data/ntuples_skim.json
+##
+##The "nevts" of every file are copied unchanged from the input json: the MC
+##normalization has to use the number of generated events, not the number of
+##events that survived the skim.  Files shared by several processes (ttbar and
+##tttt) are skimmed only once.  A skimmed file is named after its dataset,
+##its input file and a short hash of the full input path, and the columns and
+##selection it was made with are recorded next to it (<file>.root.json).
+##Existing skimmed files are not rewritten unless --force is given or the
+##columns or the selection changed, so adding a file to the json only skims
+##that file.
+##
+##Remember to rerun the skim (--force) if the selection in process() becomes
+##looser than skim_selection.
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import time
+
+import awkward as ak
+import uproot
+
+from coffeaAnalysisTemplate import MUON_PT_MIN, NTUPLES, TemplateAnalysis
+
+
+SKIM_DIR = "skim"
+SKIM_NTUPLES = "data/ntuples_skim.json"
+
+## number of events read from the input file at a time
+STEP_SIZE = 200_000
+
+
+#--------------------------------------------------
+def skim_selection(arrays, muon_pt_min=MUON_PT_MIN):
+    """Event mask of the "exactly one muon with pt > muon_pt_min" requirement."""
+    return ak.sum(arrays["Muon_pt"] > muon_pt_min, axis=1) == 1
+
+
+def skim_settings(columns, muon_pt_min=MUON_PT_MIN):
+    """What a skimmed file depends on, besides its input file."""
+    return {"columns": sorted(columns), "selection": f"exactly one muon with pt > {muon_pt_min}",
+            "selection_code": hashlib.sha1(inspect.getsource(skim_selection).encode()).hexdigest()}
+
+
+def skim_path(outdir, dataset, path):
+    """Skimmed file of ``path``, unique even for inputs with the same basename."""
+    stem = os.path.splitext(os.path.basename(path.split("://")[-1]))[0]
+    return os.path.join(outdir, f"{dataset}_{stem}_{hashlib.sha1(path.encode()).hexdigest()[:8]}.root")
+
+
+def up_to_date(outpath, settings):
+    """Whether ``outpath`` exists and was skimmed with ``settings`` (see skim_ntuples)."""
+    try:
+        with open(f"{outpath}.json") as f:
+            return os.path.exists(outpath) and json.load(f) == settings
+    except (OSError, ValueError):
+        return False
+
+
+def to_writable(arrays, columns):
+    """Group the flat NanoAOD branches into what uproot needs to write them.
+
+    Jagged branches of the same collection (Muon_pt, Muon_eta, ...) are zipped
+    into one record array, for which uproot writes Muon_pt, Muon_eta and the
+    nMuon counter back.
+    """
+    collections = {name[1:] for name in columns if name.startswith("n") and name[1:2].isupper()}
+    out = {}
+    for name in columns:
+        prefix, _, field = name.partition("_")
+        if prefix in collections and field:
+            out.setdefault(prefix, {})[field] = arrays[name]
+        elif name[1:] in collections:
+            continue  # counters are rewritten by uproot
+        else:
+            out[name] = arrays[name]
+    return {k: ak.zip(v) if isinstance(v, dict) else v for k, v in out.items()}
+
+
+def copy_runs(infile, outfile):
+    """Copy the flat branches of the Runs tree (genEventSumw, ...), if any."""
+    if "Runs" not in infile:
+        return
+    runs = infile["Runs"]
+    names = [name for name, branch in runs.items() if isinstance(branch.interpretation, uproot.AsDtype)]
+    if names:
+        outfile["Runs"] = runs.arrays(names, library="np")
+
+
+def skim_file(path, outpath, columns, muon_pt_min=MUON_PT_MIN, step_size=STEP_SIZE):
+    """Skim one input file, return (events read, events written)."""
+    nread = nwritten = 0
+    tmp = f"{outpath}.tmp"
+    with uproot.open(path) as infile, uproot.recreate(tmp) as outfile:
+        tree = infile["Events"]
+        ## data has no generator branches (genWeight)
+        columns = [name for name in columns if name in tree]
+        for arrays in tree.iterate(columns, step_size=step_size, how=dict):
+            mask = skim_selection(arrays, muon_pt_min)
+            nread += len(mask)
+            selected = to_writable({k: v[mask] for k, v in arrays.items()}, columns)
+            nwritten += int(ak.sum(mask))
+            if "Events" in outfile:
+                outfile["Events"].extend(selected)
+            else:
+                outfile["Events"] = selected
+        copy_runs(infile, outfile)
+    ## only files that were completely written get their final name
+    os.replace(tmp, outpath)
+    return nread, nwritten
+
+
+def skim_ntuples(ntuples_json=NTUPLES, outdir=SKIM_DIR, output_json=SKIM_NTUPLES,
+                 n_files_max_per_sample=-1, muon_pt_min=MUON_PT_MIN, step_size=STEP_SIZE, force=False):
+    """Skim every file listed in ``ntuples_json`` and write ``output_json``."""
+    columns = TemplateAnalysis.columns
+    settings = skim_settings(columns, muon_pt_min)
+    with open(ntuples_json) as f:
+        file_info = json.load(f)
+    os.makedirs(outdir, exist_ok=True)
+
+    skimmed = {}
+    for process, variations in file_info.items():
+        for variation, info in variations.items():
+            file_list = info["files"]
+            if n_files_max_per_sample != -1:
+                file_list = file_list[:n_files_max_per_sample]
+            for entry in file_list:
+                path = entry["path"]
+                if path not in skimmed:
+                    outpath = skim_path(outdir, f"{process}__{variation}", path)
+                    recorded = dict(settings, source=path)
+                    if force or not up_to_date(outpath, recorded):
+                        t0 = time.monotonic()
+                        nread, nwritten = skim_file(path, outpath, columns, muon_pt_min, step_size)
+                        with open(f"{outpath}.json", "w") as f:
+                            json.dump(recorded, f, indent=2)
+                        print(f"{path}: kept {nwritten} of {nread} events ({time.monotonic() - t0:.1f} s)")
+                    else:
+                        print(f"{path}: already skimmed in {outpath}")
+                    skimmed[path] = outpath
+                entry["path"] = f"file:{skimmed[path]}"
+                entry["skimmed_from"] = path
+            info["files"] = file_list
+            info["skim"] = {"columns": columns, "selection": f"exactly one muon with pt > {muon_pt_min}"}
+
+    with open(output_json, "w") as f:
+        json.dump(file_info, f, indent=2)
+    print(f"wrote {output_json}")
+    return file_info
+#--------------------------------------------------
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write slim, preselected copies of the NanoAOD inputs")
+    parser.add_argument("--ntuples", default=NTUPLES, help=f"input json (default: {NTUPLES})")
+    parser.add_argument("--outdir", default=SKIM_DIR, help=f"directory for the skimmed files (default: {SKIM_DIR})")
+    parser.add_argument("--output", default=SKIM_NTUPLES, help=f"json for the skimmed files (default: {SKIM_NTUPLES})")
+    parser.add_argument("--nfiles", type=int, default=-1, help="input files per process, -1 means all (default: -1)")
+    parser.add_argument("--step-size", type=int, default=STEP_SIZE, help=f"events read at a time (default: {STEP_SIZE})")
+    parser.add_argument("--force", action="store_true", help="skim again files that were already skimmed")
+    args = parser.parse_args()
+
+    skim_ntuples(args.ntuples, args.outdir, args.output, args.nfiles,
+                 step_size=args.step_size, force=args.force)
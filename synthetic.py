@@ -0,0 +1,113 @@
+##Synthetic NanoAOD-like files, for benchmarks and tests that must run
+##without network or EOS access.
+##
+##The files have an "Events" tree with the Muon, Jet and Electron collections
+##(pt, eta, phi, mass and a few extra branches), PV and genWeight, and a "Runs"
+##tree with genEventCount and genEventSumw, laid out like CMS NanoAOD
+##(nMuon counter + Muon_* branches).  Object multiplicities are Poisson
+##distributed, with a mean that depends on the process so that the jagged
+##arrays look roughly like the real ttbar/tttt/dyjets/wjets/data samples.
+##make_synthetic_ntuples() also writes an ntuples json with the same layout as
+##data/ntuples.json (including ttbar and tttt sharing their files), which
+##construct_fileset can read directly.
+import json
+import os
+
+import awkward as ak
+import numpy as np
+import uproot
+
+
+## mean number of muons, jets and electrons per event
+PROFILES = {
+    "data":   {"Muon": 1.1, "Jet": 3.0, "Electron": 0.6},
+    "tttt":   {"Muon": 1.2, "Jet": 8.0, "Electron": 0.9},
+    "ttbar":  {"Muon": 1.2, "Jet": 6.0, "Electron": 0.8},
+    "dyjets": {"Muon": 1.6, "Jet": 2.5, "Electron": 0.4},
+    "wjets":  {"Muon": 1.0, "Jet": 2.0, "Electron": 0.5},
+}
+
+COMPRESSION = {"zlib": uproot.ZLIB, "lzma": uproot.LZMA, "lz4": uproot.LZ4, "zstd": uproot.ZSTD}
+
+
+#--------------------------------------------------
+def _collection(rng, mean, n_events, pt_scale, eta_max, extra):
+    counts = rng.poisson(mean, n_events)
+    n = int(counts.sum())
+    fields = {"pt": (rng.exponential(pt_scale, n) + 3).astype(np.float32),
+              "eta": rng.uniform(-eta_max, eta_max, n).astype(np.float32),
+              "phi": rng.uniform(-np.pi, np.pi, n).astype(np.float32)}
+    fields.update({name: make(n) for name, make in extra.items()})
+    return ak.unflatten(ak.zip(fields), counts)
+
+
+def make_nanoaod_file(path, n_events, process="ttbar", seed=0, compression="zlib", step=100_000):
+    """Write a synthetic NanoAOD-like file with ``n_events`` events."""
+    rng = np.random.default_rng([seed, list(PROFILES).index(process)])
+    profile = PROFILES[process]
+    with uproot.recreate(path, compression=COMPRESSION[compression](1)) as f:
+        for start in range(0, n_events, step):
+            n = min(step, n_events - start)
+            charge = lambda k: rng.choice(np.array([-1, 1], dtype=np.int32), k)
+            arrays = {
+                "Muon": _collection(rng, profile["Muon"], n, 25., 2.4,
+                                    {"mass": lambda k: np.full(k, 0.1057, np.float32), "charge": charge,
+                                     "pfRelIso04_all": lambda k: rng.exponential(0.2, k).astype(np.float32)}),
+                "Jet": _collection(rng, profile["Jet"], n, 35., 4.7,
+                                   {"mass": lambda k: rng.exponential(8., k).astype(np.float32),
+                                    "btagCSVV2": lambda k: rng.uniform(0, 1, k).astype(np.float32),
+                                    "jetId": lambda k: rng.choice(np.array([0, 2, 6], dtype=np.int32), k)}),
+                "Electron": _collection(rng, profile["Electron"], n, 20., 2.5,
+                                        {"mass": lambda k: np.full(k, 0.000511, np.float32), "charge": charge,
+                                         "cutBased": lambda k: rng.integers(0, 5, k).astype(np.int32)}),
+                "PV": ak.zip({"npvs": rng.poisson(20, n).astype(np.int32),
+                              "npvsGood": rng.poisson(18, n).astype(np.int32)}),
+                "genWeight": rng.choice(np.array([1., -1.], dtype=np.float32), n, p=[0.9, 0.1]),
+            }
+            if start == 0:
+                f["Events"] = arrays
+            else:
+                f["Events"].extend(arrays)
+        f["Runs"] = {"genEventCount": np.array([n_events], dtype=np.int64),
+                     "genEventSumw": np.array([0.8 * n_events], dtype=np.float64)}
+
+
+def make_synthetic_ntuples(outdir, n_events=100_000, n_files=2, seed=0, compression="zlib", force=False):
+    """Write ``n_files`` files of ``n_events`` per process, return the ntuples json path.
+
+    Existing files with the same settings are reused unless ``force`` is set.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    ntuples_json = os.path.join(outdir, "ntuples_synthetic.json")
+    settings_json = os.path.join(outdir, "settings.json")
+    settings = {"n_events": n_events, "n_files": n_files, "seed": seed, "compression": compression}
+    if not force and os.path.exists(ntuples_json) and os.path.exists(settings_json):
+        with open(settings_json) as f:
+            if json.load(f) == settings:
+                return ntuples_json
+        os.remove(settings_json)
+
+    def files(process):
+        out = []
+        for i in range(n_files):
+            path = os.path.abspath(os.path.join(outdir, f"{process}_{i}.root"))
+            make_nanoaod_file(path, n_events, process, seed=seed * 1000 + i, compression=compression)
+            out.append({"path": f"file:{path}", "nevts": n_events})
+        return out
+
+    ## like data/ntuples.json: ttbar reads the tttt files
+    tttt_files = files("tttt")
+    file_info = {
+        "data": {"SingleMuon": {"files": [{"path": f["path"]} for f in files("data")]}},
+        "tttt": {"nominal": {"nevts_total": n_events * n_files, "files": tttt_files}},
+        "ttbar": {"nominal": {"nevts_total": n_events * n_files, "files": list(tttt_files)}},
+        "dyjets": {"nominal": {"nevts_total": n_events * n_files, "files": files("dyjets")}},
+        "wjets": {"nominal": {"nevts_total": n_events * n_files, "files": files("wjets")}},
+    }
+    with open(ntuples_json, "w") as f:
+        json.dump(file_info, f, indent=2)
+    ## written last, so an interrupted generation is redone next time
+    with open(settings_json, "w") as f:
+        json.dump(settings, f)
+    return ntuples_json
+#--------------------------------------------------
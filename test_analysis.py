@@ -0,0 +1,185 @@
+##Regression tests of TemplateAnalysis.process and of the checkpoints, on
+##synthetic NanoAOD files (see synthetic.py), run with the iterative Runner:
+##
+##   python -m pytest test_analysis.py
+##
+##Every selected event is filled once into the per-event histograms of its
+##dataset, however many chunks the processor instance handles, and a run
+##resumed from checkpoints gives the same output as an uninterrupted one.
+##The cutflow and N-1 yields are checked against the same cuts applied as
+##plain masks to all the events.
+import copy
+
+import awkward as ak
+import numpy as np
+import pytest
+from coffea import processor
+from coffea.nanoevents import NanoAODSchema, NanoEventsFactory
+
+from checkpoint import Checkpointer
+from coffeaAnalysisTemplate import DATA, TemplateAnalysis
+from cutflow import Cutflow
+from fileplan import plan_fileset
+from selection import StagedSelection
+from synthetic import make_nanoaod_file
+
+
+@pytest.fixture(scope="module")
+def fileset(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("synthetic")
+    fileset = {}
+    for process, metadata in (("ttbar", {"process": "ttbar", "variation": "nominal", "nevts": 3000, "xsec": 4.155}),
+                              ("data", {"process": "data", "xsec": 1})):
+        path = str(tmp / f"{process}.root")
+        make_nanoaod_file(path, 3000, process=process)
+        dataset = "data" if process == "data" else f"{process}__nominal"
+        fileset[dataset] = {"files": [path], "metadata": metadata}
+    return fileset
+
+
+def runner(**kwargs):
+    ## each Runner with its own metadata_cache, as in a new run: by default the
+    ## Runners of a process share the metadata of the files they preprocessed,
+    ## user metadata included, even when a later fileset changes it
+    return processor.Runner(executor=processor.IterativeExecutor(status=False), schema=NanoAODSchema,
+                            chunksize=1000, metadata_cache={}, **kwargs)
+
+
+def assert_same_output(a, b):
+    """Same histograms (slice by slice, the category order depends on the
+    order of the chunks), event counts and cutflow."""
+    assert a["nevents"] == b["nevents"]
+    assert a["cutflow"].datasets == b["cutflow"].datasets
+    for name, h in a["hists"].items():
+        other = b["hists"][name]
+        for process in h.axes["process"]:
+            for variation in h.axes["variation"]:
+                x = h[..., process, variation].view(flow=True)
+                y = other[..., process, variation].view(flow=True)
+                assert np.allclose(x["value"], y["value"]) and np.allclose(x["variance"], y["variance"])
+
+
+@pytest.fixture(scope="module")
+def output(fileset):
+    ## several chunks per file, all handled by the same processor instance
+    ## (without processor_compression every chunk gets the instance itself, not
+    ## an unpickled copy, like the threads of a FuturesExecutor)
+    run = runner(processor_compression=None)
+    return run(fileset, "Events", processor_instance=TemplateAnalysis(DATASET=DATA))
+
+
+@pytest.mark.parametrize("histogram", ["nmuons", "njets"])
+def test_per_event_histograms_count_every_event_once(output, fileset, histogram):
+    for dataset, info in fileset.items():
+        metadata = info["metadata"]
+        nevents = output["nevents"][dataset]
+        assert nevents > 0
+        ## the nominal weight of every event is the normalization of its dataset
+        h = output["hists"][histogram][:, metadata["process"], "nominal"]
+        expected = nevents * TemplateAnalysis.xsec_weight(metadata)
+        assert np.isclose(h.sum(flow=True).value, expected)
+
+
+def test_resumed_run_equals_uninterrupted_run(fileset, tmp_path):
+    analysis = TemplateAnalysis(DATASET=DATA)
+    run = runner()
+    chunks = list(run.preprocess(fileset, "Events"))
+    assert len(chunks) > 2
+    uninterrupted = run(chunks, "Events", processor_instance=analysis)
+
+    ## a first run that only got through every other chunk
+    run(chunks[::2], "Events", processor_instance=Checkpointer(analysis, tmp_path).wrap())
+
+    checkpointer = Checkpointer(analysis, tmp_path)
+    missing, done = checkpointer.split(chunks)
+    assert len(done) == len(chunks[::2]) and len(missing) == len(chunks[1::2])
+    resumed = checkpointer.merge(run(missing, "Events", processor_instance=checkpointer.wrap()), done)
+    assert_same_output(resumed, uninterrupted)
+
+
+def test_resume_after_normalization_change(fileset, tmp_path):
+    analysis = TemplateAnalysis(DATASET=DATA)
+    run = runner()
+    checkpointer = Checkpointer(analysis, tmp_path)
+    run(list(run.preprocess(fileset, "Events")), "Events", processor_instance=checkpointer.wrap())
+
+    ## e.g. a file added to the dataset in the ntuples json
+    changed = copy.deepcopy(fileset)
+    changed["ttbar__nominal"]["metadata"]["nevts"] *= 2
+    run = runner()
+    chunks = list(run.preprocess(changed, "Events"))
+    missing, done = checkpointer.split(chunks)
+    assert {item.dataset for item in missing} == {"ttbar__nominal"}
+    assert {item.dataset for item in done} == {"data"}
+
+    out = checkpointer.merge(run(missing, "Events", processor_instance=checkpointer.wrap()), done)
+    metadata = changed["ttbar__nominal"]["metadata"]
+    h = out["hists"]["nmuons"][:, "ttbar", "nominal"]
+    assert np.isclose(h.sum(flow=True).value, out["nevents"]["ttbar__nominal"] * TemplateAnalysis.xsec_weight(metadata))
+    assert np.isclose(out["cutflow"].datasets["ttbar__nominal"]["steps"]["one muon"][1],
+                      out["nevents"]["ttbar__nominal"] * TemplateAnalysis.xsec_weight(metadata))
+
+
+def test_cutflow_add():
+    a, b = Cutflow(), Cutflow()
+    a.datasets = {"ttbar__nominal": {"steps": {"all events": [10, 5.], "one muon": [4, 2.]}, "nminusone": {}}}
+    b.datasets = {"ttbar__nominal": {"steps": {"all events": [6, 3.], "one muon": [1, .5]}, "nminusone": {}},
+                  "data": {"steps": {"all events": [7, 7.]}, "nminusone": {"one muon": [3, 3.]}}}
+    total = a + b
+    assert total.datasets == {"ttbar__nominal": {"steps": {"all events": [16, 8.], "one muon": [5, 2.5]}, "nminusone": {}},
+                              "data": {"steps": {"all events": [7, 7.]}, "nminusone": {"one muon": [3, 3.]}}}
+    ## a + b leaves both unchanged, add() merges in place
+    assert a.datasets["ttbar__nominal"]["steps"]["all events"] == [10, 5.]
+    assert b.datasets["data"]["nminusone"]["one muon"] == [3, 3.]
+    a.add(b)
+    assert a.datasets == total.datasets
+    assert list(a.datasets["ttbar__nominal"]["steps"]) == ["all events", "one muon"]
+
+
+def test_nminusone_yields_match_masks(fileset):
+    events = NanoEventsFactory.from_root(fileset["ttbar__nominal"]["files"][0], schemaclass=NanoAODSchema).events()
+    cuts = {"primary vertex": lambda events: events.PV.npvsGood >= 18,
+            "one muon": lambda events: ak.num(events.Muon[events.Muon.pt > 25]) == 1,
+            "4 jets": lambda events: ak.num(events.Jet[events.Jet.pt > 30]) >= 4}
+    selection = StagedSelection(events, weight=lambda events: events.genWeight, nminusone=True)
+    for name, cut in cuts.items():
+        selection.require(name, cut)
+
+    ## the same cuts as masks over all the events
+    masks = {name: ak.to_numpy(cut(events)) for name, cut in cuts.items()}
+    genweight = ak.to_numpy(events.genWeight)
+    passed = np.ones(len(events), dtype=bool)
+    for (name, n, sumw), cut in zip(selection.yields[1:], masks):
+        passed &= masks[cut]
+        assert (name, n) == (cut, passed.sum()) and np.isclose(sumw, genweight[passed].sum())
+
+    yields = selection.nminusone_yields()
+    assert list(yields) == list(cuts)
+    for name in cuts:
+        others = np.logical_and.reduce([mask for cut, mask in masks.items() if cut != name])
+        ## passing every cut, plus failing only this one
+        failed_only = others & ~masks[name]
+        assert yields[name][0] == passed.sum() + failed_only.sum() == others.sum()
+        assert np.isclose(yields[name][1], genweight[others].sum())
+
+
+def test_cutflow_weight_per_target(fileset):
+    ## ttbar normalized with the sum of generator weights, tttt with nevts,
+    ## both read from the same file (see fileplan.py)
+    path = fileset["ttbar__nominal"]["files"][0]
+    shared = {"ttbar__nominal": {"files": [path], "metadata": {"process": "ttbar", "variation": "nominal",
+                                                               "nevts": 3000, "sumw": 2400., "xsec": 4.155}},
+              "tttt__nominal": {"files": [path], "metadata": {"process": "tttt", "variation": "nominal",
+                                                              "nevts": 3000, "xsec": 0.009}}}
+    planned, _ = plan_fileset(shared)
+    assert list(planned) == ["ttbar__nominal+tttt__nominal"]
+    out = runner()(planned, "Events", processor_instance=TemplateAnalysis(DATASET=DATA))
+
+    events = NanoEventsFactory.from_root(path, schemaclass=NanoAODSchema).events()
+    passed = ak.to_numpy((events.PV.npvsGood >= 1) & (ak.count(TemplateAnalysis.select_muons(events.Muon).pt, axis=1) == 1))
+    sumw = ak.to_numpy(events.genWeight)[passed].sum()
+    ttbar = out["cutflow"].datasets["ttbar__nominal"]["steps"]["one muon"]
+    tttt = out["cutflow"].datasets["tttt__nominal"]["steps"]["one muon"]
+    assert ttbar[0] == tttt[0] == passed.sum()
+    assert np.isclose(ttbar[1], sumw * TemplateAnalysis.xsec_weight(shared["ttbar__nominal"]["metadata"]))
+    assert np.isclose(tttt[1], passed.sum() * TemplateAnalysis.xsec_weight(shared["tttt__nominal"]["metadata"]))
@@ -0,0 +1,77 @@
+##Round trip of the on-disk histogram format (see histfile.py):
+##
+##   python -m pytest test_histfile.py
+##
+##A Weight histogram with category axes, written by save_histograms and read
+##back with HistDirectory, has the values and variances of the original,
+##flow bins included, whether it is read one slice at a time or whole.
+import pickle
+
+import hist
+import numpy as np
+import pytest
+
+from histfile import HistDirectory, load_histograms, save_histograms
+
+
+@pytest.fixture
+def original():
+    h = hist.Hist(hist.axis.Regular(20, 0, 200, name="pt", label="$p_T$ [GeV]"),
+                  hist.axis.StrCategory([], name="process", growth=True),
+                  hist.axis.StrCategory([], name="variation", growth=True),
+                  storage=hist.storage.Weight())
+    rng = np.random.default_rng(1)
+    for process, variation in (("ttbar", "nominal"), ("ttbar", "pt_scale_up"), ("data", "nominal")):
+        ## some entries in the underflow and overflow bins too
+        pt = rng.uniform(-20, 250, 1000)
+        h.fill(pt=pt, process=process, variation=variation, weight=rng.uniform(0.5, 1.5, 1000))
+    ## data has no pt_scale_up: an empty slice, which is not written
+    return h
+
+
+def assert_same_view(a, b):
+    x, y = a.view(flow=True), b.view(flow=True)
+    assert np.allclose(x["value"], y["value"]) and np.allclose(x["variance"], y["variance"])
+
+
+def test_slices_equal_original(original, tmp_path):
+    save_histograms({"muon_pt": original}, str(tmp_path / "histograms"))
+    hists = HistDirectory(str(tmp_path / "histograms"))
+    assert list(hists) == ["muon_pt"]
+    assert hists.categories("muon_pt") == {"process": ["ttbar", "data"], "variation": ["nominal", "pt_scale_up"]}
+    for process in original.axes["process"]:
+        for variation in original.axes["variation"]:
+            h = hists.slice("muon_pt", process=process, variation=variation)
+            assert h.axes[0] == original.axes[0]
+            assert_same_view(h, original[:, process, variation])
+    assert hists.slice("muon_pt", process="data", variation="pt_scale_up").sum(flow=True).value == 0
+
+
+def test_full_histogram_equals_original(original, tmp_path):
+    save_histograms({"muon_pt": original}, str(tmp_path / "histograms"))
+    h = HistDirectory(str(tmp_path / "histograms"))["muon_pt"]
+    assert h.axes == original.axes
+    assert h.axes[0].label == original.axes[0].label
+    assert_same_view(h, original)
+
+
+def test_bad_slice(original, tmp_path):
+    save_histograms({"muon_pt": original}, str(tmp_path / "histograms"))
+    hists = HistDirectory(str(tmp_path / "histograms"))
+    with pytest.raises(TypeError):
+        hists.slice("muon_pt", process="ttbar")
+    with pytest.raises(KeyError):
+        hists.slice("muon_pt", process="tttt", variation="nominal")
+
+
+def test_save_replaces_and_legacy_pickle(original, tmp_path):
+    directory = str(tmp_path / "histograms")
+    save_histograms({"muon_pt": original, "other": original}, directory)
+    save_histograms({"muon_pt": original * 2}, directory)
+    hists = load_histograms(directory)
+    assert list(hists) == ["muon_pt"]
+    assert_same_view(hists["muon_pt"], original * 2)
+
+    with open(tmp_path / "histograms.pkl", "wb") as f:
+        pickle.dump({"muon_pt": original}, f)
+    assert_same_view(load_histograms(str(tmp_path / "histograms.pkl"))["muon_pt"], original)